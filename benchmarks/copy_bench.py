@@ -0,0 +1,60 @@
+"""
+Compares field-aware Document.copy_in_place with copy.deepcopy of
+document data for documents with nested lists of documents.
+
+    python benchmarks/copy_bench.py [count]
+"""
+from __future__ import print_function, unicode_literals
+import sys
+import copy
+import timeit
+from datetime import datetime
+
+from bson import ObjectId
+
+from ognom.document import Document
+from ognom.fields import (
+    StringField, IntField, DateTimeField, ListField, DictField,
+    DocumentField)
+
+
+class Item(Document):
+    sku = StringField()
+    quantity = IntField()
+    added_at = DateTimeField()
+
+
+class Order(Document):
+    customer = StringField()
+    created_at = DateTimeField()
+    items = ListField(DocumentField(Item))
+    tags = ListField(StringField())
+    attributes = DictField(StringField())
+
+
+def main(count):
+    now = datetime.utcnow()
+    order = Order(
+        _id=ObjectId(), customer='customer', created_at=now,
+        items=[Item(sku='sku{}'.format(i), quantity=i, added_at=now)
+               for i in range(20)],
+        tags=['a', 'b', 'c'],
+        attributes={'key{}'.format(i): 'value' for i in range(10)})
+    target = Order()
+
+    def deepcopy_baseline():
+        target._data = copy.deepcopy(order._data)
+
+    def field_aware():
+        target.copy_in_place(order)
+
+    baseline = timeit.timeit(deepcopy_baseline, number=count)
+    optimized = timeit.timeit(field_aware, number=count)
+    print('copies:        {}'.format(count))
+    print('deepcopy:      {:.3f}s'.format(baseline))
+    print('field-aware:   {:.3f}s'.format(optimized))
+    print('speedup:       {:.1f}x'.format(baseline / optimized))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,92 @@
+"""
+Compares memory retained by loaded documents with default dict storage
+and compact (``__slots__``) storage. Payloads are decoded from BSON for
+each document, as they are by pymongo, so anything a document keeps of
+its payload is counted as well.
+
+    python benchmarks/memory.py [count]
+"""
+from __future__ import print_function, unicode_literals
+import gc
+import sys
+import tracemalloc
+from datetime import datetime
+
+from bson import BSON, ObjectId
+
+from ognom.document import Document
+from ognom.fields import (
+    StringField, IntField, BooleanField, DateTimeField, ListField,
+    DictField, DocumentField)
+
+
+class Item(Document):
+    name = StringField()
+    count = IntField()
+
+
+class DictDoc(Document):
+    name = StringField()
+    email = StringField()
+    age = IntField()
+    active = BooleanField(default=True)
+    created_at = DateTimeField()
+    tags = ListField(StringField())
+    items = ListField(DocumentField(Item))
+    attributes = DictField(IntField())
+
+
+class CompactItem(Document):
+    __slots__ = ()
+
+    name = StringField()
+    count = IntField()
+
+
+class CompactDoc(Document):
+    __slots__ = ()
+
+    name = StringField()
+    email = StringField()
+    age = IntField()
+    active = BooleanField(default=True)
+    created_at = DateTimeField()
+    tags = ListField(StringField())
+    items = ListField(DocumentField(CompactItem))
+    attributes = DictField(IntField())
+
+
+def measure(doc_cls, payloads):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    docs = [doc_cls.from_mongo(BSON(data).decode()) for data in payloads]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / float(len(docs))
+
+
+def main(count):
+    now = datetime.utcnow()
+    payloads = [BSON.encode({
+        '_id': ObjectId(),
+        'name': 'name',
+        'email': 'name@example.com',
+        'age': 42,
+        'active': True,
+        'created_at': now,
+        'tags': ['tag{}'.format(i) for i in range(20)],
+        'items': [{'name': 'item', 'count': i} for i in range(10)],
+        'attributes': {'key{}'.format(i): i for i in range(10)},
+    }) for _ in range(count)]
+
+    dict_size = measure(DictDoc, payloads)
+    compact_size = measure(CompactDoc, payloads)
+    print('documents:        {}'.format(count))
+    print('dict storage:     {:.1f} bytes/doc'.format(dict_size))
+    print('compact storage:  {:.1f} bytes/doc'.format(compact_size))
+    print('saved:            {:.1%}'.format(1 - compact_size / dict_size))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
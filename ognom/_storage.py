@@ -0,0 +1,273 @@
+from __future__ import unicode_literals
+import copy
+from collections import OrderedDict
+
+
+def slot_name(key):
+    """
+    Returns name of the slot keeping value of ``key`` in generated
+    stores, field descriptors read and write it directly.
+    """
+    return str('f_{}'.format(key))
+
+
+class SlotStore(object):
+    """
+    Mapping which keeps document values in slots instead of a dict.
+    Subclass with one slot per field is generated for each compact
+    document class (see ``make_slot_store``). Keys which have no slot
+    assigned are kept in a separate dict, created on demand.
+    """
+    __slots__ = ('_extra',)
+
+    _layout = OrderedDict()  # key -> slot name
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        slot = self._layout.get(key)
+        if slot is not None:
+            try:
+                return getattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        slot = self._layout.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        slot = self._layout.get(key)
+        if slot is not None:
+            try:
+                delattr(self, slot)
+            except AttributeError:
+                raise KeyError(key)
+            return
+        if self._extra is None:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __contains__(self, key):
+        slot = self._layout.get(key)
+        if slot is not None:
+            return hasattr(self, slot)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, SlotStore)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, dict(self.items()))
+
+    def __reduce__(self):
+        # store classes are generated, so pickled store becomes plain dict
+        return dict, (dict(self.items()),)
+
+    def __copy__(self):
+        return self.__class__(self.items())
+
+    def __deepcopy__(self, memo):
+        return self.__class__(
+            (key, copy.deepcopy(value, memo)) for key, value in self.items())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        result = []
+        for key, slot in self._layout.items():
+            try:
+                result.append((key, getattr(self, slot)))
+            except AttributeError:
+                pass
+        if self._extra:
+            result.extend(self._extra.items())
+        return result
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def update(self, *args, **kwargs):
+        for other in args + (kwargs,):
+            if hasattr(other, 'keys'):
+                other = [(key, other[key]) for key in other.keys()]
+            for key, value in other:
+                self[key] = value
+
+    def copy(self):
+        return self.__copy__()
+
+
+def make_slot_store(name, keys):
+    """
+    Generates ``SlotStore`` subclass with a slot per key, slots are laid
+    out in order of ``keys`` and named by ``slot_name``, so a field
+    inherited by several compact classes has the same slot name in
+    stores of all of them.
+    """
+    layout = OrderedDict((key, slot_name(key)) for key in keys)
+    store_cls = type(
+        str(name), (SlotStore,), {'__slots__': tuple(layout.values())})
+    store_cls._layout = layout
+    return store_cls
+
+
+class LazyData(object):
+    """
+    Mapping over raw mongo payload, values are converted with field
+    decoders on first access and moved to ``data`` (store of document
+    class). Raw values of untouched keys are reused by the encoder.
+    """
+    __slots__ = ('raw', 'data', '_decoders')
+
+    def __init__(self, raw, data, decoders):
+        self.raw = raw
+        self.data = data
+        self._decoders = decoders
+
+    def _convert(self, key):
+        value = self._decoders[key](self.raw.pop(key))
+        self.data[key] = value
+        return value
+
+    def _convert_all(self):
+        for key in list(self.raw):
+            self._convert(key)
+        return self.data
+
+    def __getitem__(self, key):
+        if key in self.raw:
+            return self._convert(key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.raw.pop(key, None)
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        if key in self.raw:
+            del self.raw[key]
+        else:
+            del self.data[key]
+
+    def __contains__(self, key):
+        return key in self.raw or key in self.data
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.raw) + len(self.data)
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, SlotStore, LazyData)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'LazyData(raw={!r}, data={!r})'.format(self.raw, self.data)
+
+    def __reduce__(self):
+        return dict, (dict(self.items()),)
+
+    def __copy__(self):
+        return copy.copy(self._convert_all())
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._convert_all(), memo)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return list(self._convert_all().items())
+
+    def keys(self):
+        return list(self.raw.keys()) + list(self.data.keys())
+
+    def values(self):
+        return list(self._convert_all().values())
+
+    def pop(self, key, *default):
+        if key in self.raw:
+            self._convert(key)
+        return self.data.pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def update(self, *args, **kwargs):
+        for other in args + (kwargs,):
+            if hasattr(other, 'keys'):
+                other = [(key, other[key]) for key in other.keys()]
+            for key, value in other:
+                self[key] = value
+
+    def copy(self):
+        return self.__copy__()
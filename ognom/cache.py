@@ -0,0 +1,111 @@
+from __future__ import unicode_literals
+import threading
+import time
+from collections import OrderedDict
+
+import six
+
+
+# operators which values are queries or lists of queries
+_QUERY_OPERATORS = frozenset(['$and', '$or', '$nor', '$not', '$elemMatch'])
+
+
+def _freeze(value, unordered=False):
+    # order of keys doesn't matter in query and operator dicts,
+    # but does in embedded documents matched by equality, including
+    # the ones listed in $in, $nin or $all
+    if isinstance(value, dict):
+        unordered = unordered or any(
+            key.startswith('$') for key in value)
+        items = tuple(
+            (key, _freeze(item, key in _QUERY_OPERATORS))
+            for key, item in value.items())
+        return 'dict', tuple(sorted(items)) if unordered else items
+    if isinstance(value, (list, tuple)):
+        return 'list', tuple(_freeze(item, unordered) for item in value)
+    return type(value).__name__, value
+
+
+def canonical_key(**parts):
+    """
+    Returns hashable key of query made of ``parts`` (spec, fields, sort
+    and so on), equivalent queries written with different order of keys
+    get the same key. Raises TypeError if some value is not hashable.
+    """
+    key = tuple(sorted(
+        (name, _freeze(value, True)) for name, value in six.iteritems(parts)))
+    hash(key)
+    return key
+
+
+class LRUCache(object):
+    """
+    Thread safe mapping of limited size. Least recently used entries are
+    evicted when it's full, entries older than ``ttl`` seconds are
+    treated as missing.
+    """
+    def __init__(self, max_size=1000, ttl=None, clock=time.time):
+        """
+        :param max_size: maximum number of entries;
+        :param ttl: entry lifetime in seconds, None for unlimited;
+        :param clock: callable returning current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (value, expiration time)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # incremented on invalidation, see ``set``
+        self.version = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or (
+                    entry[1] is not None and entry[1] <= self._clock()):
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, version=None):
+        """
+        :param version: value of ``version`` read before the value was
+            fetched, the value is not stored if cache was invalidated
+            since then, so it can't overwrite fresher state with stale one.
+        """
+        expires = None if self.ttl is None else self._clock() + self.ttl
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self.version += 1
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
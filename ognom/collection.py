@@ -1,34 +1,125 @@
 # coding: utf8
 from __future__ import unicode_literals
-from collections import namedtuple
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
 
-from bson import ObjectId
+from bson import BSON, ObjectId
+from bson.son import SON
 from bson.errors import InvalidId
-from pymongo.cursor import Cursor
-from pymongo.errors import ConnectionFailure
+from pymongo.errors import BulkWriteError, ConnectionFailure
 from six import string_types
+from six.moves import queue
 
+from ognom.cache import canonical_key
 from ognom.fields import DateTimeField
 from ognom.connection import ConnectionManager
-from ognom.document import Document
+from ognom.document import NO_CHANGES, Document
+from ognom.streaming import DEFAULT_CHUNK_SIZE, iter_json
 
 _IndexSpec = namedtuple(
     '_IndexSpec', [
         'name', 'spec', 'background', 'unique', 'expire_after_seconds'])
 
 
+DEFAULT_BATCH_SIZE = 100
+
+DEFAULT_INSERT_CHUNK_SIZE = 1000
+
+# maximum number of ids in single $in query
+DEFAULT_IN_CHUNK_SIZE = 1000
+
+_DONE = object()
+
+
+def _read_batches(cursor, size):
+    cursor = iter(cursor)
+    while True:
+        batch = list(islice(cursor, size))
+        if not batch:
+            return
+        yield batch
+
+
+class _BackgroundReader(object):
+    """
+    Iterates over each of ``sources`` (callables returning iterables) in
+    its own background thread, items are passed through bounded queue in
+    order of arrival, so reading overlaps with processing. Exceptions of
+    sources are raised by iteration, ``close`` stops the threads.
+    """
+    def __init__(self, sources, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stopped = threading.Event()
+        self.threads = []
+        for source in sources:
+            thread = threading.Thread(target=self._read, args=(source,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _read(self, source):
+        try:
+            for item in source():
+                self._put(item)
+                if self.stopped.is_set():
+                    break
+        except Exception as ex:
+            self._put(ex)
+        self._put(_DONE)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        running = len(self.threads)
+        while running:
+            item = self.queue.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
 class CursorWrapper(object):
-    def __init__(self, cursor, serialize=None):
+    def __init__(self, cursor, serialize=None, prefetch=None):
+        """
+        :param cursor: pymongo cursor;
+        :param serialize: callable applied to each result;
+        :param prefetch: number of batches to read ahead in background
+            thread while iterating, disabled by default.
+        """
         self.cursor = cursor
         self.serialize = serialize
+        self.prefetch = prefetch
+        self._batch_size = DEFAULT_BATCH_SIZE
+        self._prefetcher = None
+        self._related = ()
 
     def __getitem__(self, item):
         item_or_slice = self.cursor[item]
         if not self.serialize:
             return item_or_slice
 
-        if isinstance(item_or_slice, Cursor):
-            return [self.serialize(i) for i in item_or_slice]
+        if isinstance(item, slice):
+            result = [self.serialize(i) for i in item_or_slice]
+            if self._related:
+                self._resolve_related(result)
+            return result
 
         return self.serialize(item_or_slice)
 
@@ -36,11 +127,46 @@ class CursorWrapper(object):
         return getattr(self.cursor, item)
 
     def __iter__(self):
+        if self.prefetch or self._related:
+            return (
+                item
+                for batch in self._iter_raw_batches(self._batch_size)
+                for item in batch
+            )
         return (
             self.serialize(r) if self.serialize else r
             for r in self.cursor
         )
 
+    def _iter_raw_batches(self, size):
+        serialize = self.serialize
+        if self.prefetch:
+            batches = self._prefetcher = _BackgroundReader(
+                [partial(_read_batches, self.cursor, size)], self.prefetch)
+        else:
+            batches = _read_batches(self.cursor, size)
+        try:
+            for batch in batches:
+                if serialize:
+                    batch = [serialize(item) for item in batch]
+                    if self._related:
+                        self._resolve_related(batch)
+                yield batch
+        finally:
+            # iteration is finished or stopped early
+            if self.prefetch:
+                batches.close()
+
+    def batch_size(self, batch_size):
+        self._batch_size = batch_size
+        self.cursor.batch_size(batch_size)
+        return self
+
+    def close(self):
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+        self.cursor.close()
+
     def skip(self, count):
         self.cursor.skip(count)
         return self
@@ -58,30 +184,491 @@ class CursorWrapper(object):
     def as_list(self):
         return list(self)
 
+    def iter_batches(self, size):
+        """
+        Yields results as lists of at most ``size`` items. Driver batch
+        size is set to the same value, so each list is fetched with one
+        round trip and deserialized at once. With prefetch enabled next
+        batches are fetched while current one is processed.
+        """
+        self.cursor.batch_size(size)
+        return self._iter_raw_batches(size)
+
+    def iter_json(self, chunk_size=DEFAULT_CHUNK_SIZE, encoding=None):
+        """
+        Yields results as chunks of JSON array, see ``streaming.iter_json``.
+        """
+        return iter_json(self, chunk_size, encoding)
+
+    def select_related(self, *names):
+        """
+        Makes documents referenced by ``names`` fields (see
+        ``ReferenceField``) fetched for each batch of results: ids are
+        collected from the batch and each referenced collection is
+        queried once with ``get_many``.
+        """
+        self._related = names
+        return self
+
+    def _resolve_related(self, docs):
+        if not docs:
+            return
+        doc_cls = type(docs[0])
+        for name in self._related:
+            field = getattr(doc_cls, name, None)
+            if not hasattr(field, 'resolve'):
+                raise ValueError(
+                    '{} is not a reference field of {}'.format(
+                        name, doc_cls.__name__))
+            pending = [
+                doc for doc in docs
+                if field.get_id(doc) is not None and
+                not field.is_resolved(doc)]
+            if not pending:
+                continue
+            ids = [field.get_id(doc) for doc in pending]
+            referenced = field.model_class.objects.get_many(ids)
+            for doc, document in zip(pending, referenced):
+                if document is not None:
+                    field.resolve(doc, document)
+
+
+class BulkResult(object):
+    """
+    Outcome of ``Bulk`` execution.
+    :ivar details: result document returned by mongo;
+    :ivar results: list with an item per queued operation: ``_id`` of
+        saved, inserted or upserted document or None;
+    :ivar errors: dict of operation index -> write error, operations
+        queued after failed one are not applied in ordered mode and are
+        listed in ``skipped``. Saves of partial documents removed
+        meanwhile are reported here too, with None ``code``, other
+        documents removed meanwhile are stored again as a whole.
+    """
+    def __init__(self, details, results, errors, skipped):
+        self.details = details
+        self.results = results
+        self.errors = errors
+        self.skipped = skipped
+
+    @property
+    def ok(self):
+        return not (self.errors or self.details.get('writeConcernErrors'))
+
+
+class Bulk(object):
+    """
+    Unit of work which queues writes to collection and sends them with
+    bulk write batches on ``execute``, or on exit if used as context
+    manager. Documents are validated when queued, new ones get ``_id``
+    assigned on success.
+    """
+    def __init__(self, objects, ordered=True, w=1):
+        """
+        :param objects: ``Collection`` to write to;
+        :param ordered: if True operations are applied in order and
+            execution stops on the first error, otherwise all operations
+            are attempted;
+        :param w: write concern of the whole batch.
+        """
+        self.objects = objects
+        self.ordered = ordered
+        self.w = w
+        self.result = None
+        # (document, whether _id was generated for it, $set/$unset update
+        # or mongo representation it's written with, see _mark_stored)
+        self._ops = []
+        # specs of existing documents written by queued operations
+        self._touched = []
+        # indexes of $set updates of loaded or saved documents
+        self._updates = []
+        if ordered:
+            self._bulk = objects.collection.initialize_ordered_bulk_op()
+        else:
+            self._bulk = objects.collection.initialize_unordered_bulk_op()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def __len__(self):
+        return len(self._ops)
+
+    def _insert(self, doc, saved=False):
+        doc_as_dict = self.objects._to_replacement(doc)
+        generated = not doc._id
+        if generated:
+            doc._id = ObjectId()
+        doc_as_dict['_id'] = doc._id
+        self._bulk.insert(doc_as_dict)
+        # values of inserted documents are not kept, like in insert
+        self._ops.append(
+            (doc, generated, None, doc_as_dict if saved else None))
+
+    def save(self, doc):
+        """
+        Queues save of document, see ``Collection.save``.
+        """
+        doc.validate()
+        if self.objects._can_update(doc):
+            update = doc.to_mongo_update()
+            if update:
+                # per operation results are not reported by bulk, so
+                # documents removed meanwhile are found after execution
+                self._updates.append(len(self._ops))
+                self._bulk.find({'_id': doc._id}).update_one(update)
+                self._ops.append((doc, False, update, None))
+                self._touched.append(doc._id)
+        elif doc._data.get('_id'):
+            doc_as_dict = self.objects._to_replacement(doc)
+            self._bulk.find({'_id': doc._id}).upsert().replace_one(
+                doc_as_dict)
+            self._ops.append((doc, False, None, doc_as_dict))
+            self._touched.append(doc._id)
+        else:
+            self._insert(doc, saved=True)
+
+    def insert(self, doc_or_docs):
+        if isinstance(doc_or_docs, Document):
+            doc_or_docs = [doc_or_docs]
+        for doc in doc_or_docs:
+            doc.validate()
+            self._insert(doc)
+
+    def update(self, spec_or_id, document, multi=False, upsert=False):
+        """
+        Queues update, see ``Collection.update``.
+        """
+        if not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id': ObjectId(spec_or_id)}
+        view = self._bulk.find(spec_or_id)
+        self._touched.append(spec_or_id)
+        if upsert:
+            view = view.upsert()
+        if isinstance(document, Document):
+            doc_as_dict = self.objects._to_replacement(document)
+            view.replace_one(doc_as_dict)
+            self._ops.append((document, False, None, doc_as_dict))
+        else:
+            if multi:
+                view.update(document)
+            else:
+                view.update_one(document)
+            self._ops.append((None, False, None, None))
+
+    def remove(self, spec_or_id=None):
+        if isinstance(spec_or_id, Document):
+            # the whole document has to be written if saved again
+            spec_or_id._changed = None
+            spec_or_id = {'_id': spec_or_id._id}
+        elif spec_or_id is None:
+            spec_or_id = {}
+        elif not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id': ObjectId(spec_or_id)}
+        self._bulk.find(spec_or_id).remove()
+        self._ops.append((None, False, None, None))
+        self._touched.append(spec_or_id)
+
+    def _find_removed(self, errors, skipped):
+        # returns indexes of applied $set updates which matched nothing
+        ids = {
+            index: self._ops[index][0]._id for index in self._updates
+            if index not in errors and index not in skipped}
+        if not ids:
+            return []
+        found = set(
+            item['_id'] for item in self.objects.collection.find(
+                {'_id': {'$in': list(ids.values())}}, {'_id': 1}))
+        return sorted(
+            index for index, _id in ids.items() if _id not in found)
+
+    def _recreate(self, indexes):
+        """
+        Stores documents removed before their $set updates were applied
+        again as a whole, see ``Collection.save``.
+        :return: (dict of index -> mongo representation of stored
+            document, dict of index -> write error).
+        """
+        stored = {}
+        errors = {}
+        for index in indexes:
+            doc = self._ops[index][0]
+            if doc.is_partial:
+                errors[index] = {
+                    'index': index, 'code': None,
+                    'errmsg': 'Partial document {!r} was removed and could '
+                              'not be stored again'.format(doc)}
+            else:
+                stored[index] = self.objects._to_recreated(doc)
+        if not stored:
+            return stored, errors
+
+        bulk = self.objects.collection.initialize_unordered_bulk_op()
+        positions = sorted(stored)
+        for index in positions:
+            bulk.find({'_id': stored[index]['_id']}).upsert().replace_one(
+                stored[index])
+        try:
+            bulk.execute({'w': self.w})
+        except BulkWriteError as ex:
+            for error in ex.details.get('writeErrors', []):
+                index = positions[error['index']]
+                errors[index] = dict(error, index=index)
+                del stored[index]
+        return stored, errors
+
+    def execute(self):
+        """
+        Sends queued operations, write errors are not raised but reported
+        in returned ``BulkResult``, which is also kept as ``result``.
+        """
+        if not self._ops:
+            self.result = BulkResult({}, [], {}, set())
+            return self.result
+        try:
+            details = self._bulk.execute({'w': self.w})
+        except BulkWriteError as ex:
+            details = ex.details
+        for spec_or_id in self._touched:
+            self.objects._invalidate(spec_or_id)
+        self.objects._invalidate_queries()
+        errors = {
+            error['index']: error
+            for error in details.get('writeErrors', [])}
+        skipped = set()
+        if self.ordered and errors:
+            skipped.update(range(min(errors) + 1, len(self._ops)))
+        recreated, recreate_errors = self._recreate(
+            self._find_removed(errors, skipped))
+        errors.update(recreate_errors)
+        upserted = {
+            item['index']: item['_id']
+            for item in details.get('upserted', [])}
+
+        results = []
+        for index, (doc, generated, update, doc_as_dict) in enumerate(
+                self._ops):
+            if index in errors or index in skipped:
+                if generated:
+                    doc._id = None
+                results.append(None)
+                continue
+            if doc is not None:
+                if index in upserted:
+                    doc._id = upserted[index]
+                if doc._id:
+                    doc._mark_stored(
+                        update, recreated.get(index, doc_as_dict))
+                results.append(doc._id)
+            else:
+                results.append(upserted.get(index))
+        self.result = BulkResult(details, results, errors, skipped)
+        return self.result
+
+
+class Deferred(object):
+    """
+    Result of ``BatchLoader.load``, the document is fetched on first
+    ``get`` together with all other pending ones.
+    """
+    __slots__ = ('_loader', '_id')
+
+    def __init__(self, loader, _id):
+        self._loader = loader
+        self._id = _id
+
+    def get(self):
+        return self._loader._resolve(self._id)
+
+
+class BatchLoader(object):
+    """
+    Dataloader-style batcher: ids requested with ``load`` are collected
+    and fetched by single ``get_many`` as soon as any of the results is
+    needed. Loaded documents are memoized until exit from the scope::
+
+        with Model.objects.loader() as loader:
+            authors = [loader.load(post.author_id) for post in posts]
+            names = [author.get().name for author in authors]
+    """
+    def __init__(self, objects, chunk_size=DEFAULT_IN_CHUNK_SIZE):
+        self.objects = objects
+        self.chunk_size = chunk_size
+        self._pending = []
+        self._loaded = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._pending = []
+        self._loaded.clear()
+
+    def load(self, _id):
+        if not isinstance(_id, ObjectId):
+            _id = ObjectId(_id)
+        if _id not in self._loaded:
+            self._pending.append(_id)
+        return Deferred(self, _id)
+
+    def load_many(self, ids):
+        return [self.load(_id) for _id in ids]
+
+    def dispatch(self):
+        """
+        Fetches all pending ids with one query per chunk.
+        """
+        pending = [_id for _id in self._pending if _id not in self._loaded]
+        self._pending = []
+        if pending:
+            self._loaded.update(zip(
+                pending,
+                self.objects.get_many(pending, chunk_size=self.chunk_size)))
+
+    def _resolve(self, _id):
+        if _id not in self._loaded:
+            self.dispatch()
+        return self._loaded.get(_id)
+
 
 class Collection(object):
-    def __init__(self, db_name, collection_name=None, indexes=None):
+    def __init__(self, db_name, collection_name=None, indexes=None,
+                 cache=None, query_cache=None, count_cache=None):
         """
         Collection class. Stores/retrieves objects from database.
         :param db_name: name of the database;
         :param collection_name: collection name, if empty will be
             populated with pluaralyzed class name;
-        :param indexes: list of indexes.
+        :param indexes: list of indexes;
+        :param cache: ``LRUCache`` for documents fetched by id with
+            ``get``, entries are invalidated by writes through this
+            collection;
+        :param query_cache: ``LRUCache`` for results of ``find`` called
+            with ``cached=True``, cleared by any write through this
+            collection;
+        :param count_cache: ``LRUCache`` for results of ``count``, short
+            ttl is recommended as writes by other processes are not
+            tracked.
         """
         self.db_name = db_name
         self.collection_name = collection_name
         if indexes is None:
             indexes = []
         self.indexes = indexes
+        self.cache = cache
+        self.query_cache = query_cache
+        self.count_cache = count_cache
 
         # will be populated later
         self.model_class = None
         self._collection = None
+        self._local = threading.local()
 
-    def serialize(self, result):
+    def serialize(self, result, lazy=False, fields=None):
+        from_mongo = self.model_class.from_mongo
+        projection = self.model_class.get_projection(fields)
         if isinstance(result, (tuple, list)):
-            return [self.model_class.from_mongo(v) for v in result]
-        return self.model_class.from_mongo(result)
+            return [from_mongo(v, lazy, projection) for v in result]
+        return from_mongo(result, lazy, projection)
+
+    @staticmethod
+    def _get_id(spec_or_id):
+        # returns _id if spec selects single document by it
+        if isinstance(spec_or_id, dict):
+            if len(spec_or_id) != 1:
+                return None
+            spec_or_id = spec_or_id.get('_id')
+            if isinstance(spec_or_id, dict):
+                return None
+        if spec_or_id is None or isinstance(spec_or_id, ObjectId):
+            return spec_or_id
+        try:
+            return ObjectId(spec_or_id)
+        except (InvalidId, TypeError):
+            return None
+
+    @property
+    def _identity_map(self):
+        return getattr(self._local, 'identity_map', None)
+
+    @contextmanager
+    def session(self):
+        """
+        Identity map scope for the current thread: repeated ``get`` of
+        the same document returns the same instance without query to
+        mongo. Saved documents are put into the map, the ones changed by
+        other writes through this collection are dropped from it.
+        Nested sessions share the map of the outermost one.
+        """
+        outer = self._identity_map
+        if outer is None:
+            self._local.identity_map = {}
+        try:
+            yield self
+        finally:
+            if outer is None:
+                self._local.identity_map = None
+
+    def _invalidate(self, spec_or_id):
+        """
+        Called on writes to documents matching ``spec_or_id``, drops them
+        from the identity map of the current session and from the cache.
+        """
+        identity_map = self._identity_map
+        cache = self.cache
+        _id = self._get_id(spec_or_id)
+        for store in (identity_map, cache):
+            if store is None:
+                continue
+            if _id is None:
+                store.clear()
+            else:
+                store.pop(_id, None)
+        self._invalidate_queries()
+
+    def _invalidate_queries(self):
+        """
+        Called on any write, including inserts, drops cached query results.
+        """
+        if self.query_cache is not None:
+            self.query_cache.clear()
+        if self.count_cache is not None:
+            self.count_cache.clear()
+
+    @staticmethod
+    def _copy_loaded(doc):
+        # independent instance in the same state as just loaded one
+        result = doc._clone()
+        result._changed = NO_CHANGES
+        return result
+
+    @staticmethod
+    def _to_replacement(doc):
+        # partial document would overwrite fields it has not loaded
+        if doc.is_partial:
+            raise ValueError(
+                'Partial document {!r} could be saved only with $set '
+                'update'.format(doc))
+        return doc.to_mongo()
+
+    @staticmethod
+    def _to_recreated(doc):
+        # loaded document was removed before its $set update was applied
+        if doc.is_partial:
+            raise doc.DoesNotExist(
+                'Partial document {!r} was removed and could not be '
+                'stored again'.format(doc))
+        return doc.to_mongo()
+
+    @staticmethod
+    def _can_update(doc):
+        # loaded or saved document could be stored with $set update,
+        # partial one without _id is refused then by _to_replacement
+        return bool(doc._data.get('_id') and doc._changed is not None and
+                    '_id' not in doc._changed)
 
     @property
     def collection(self):
@@ -99,7 +686,27 @@ class Collection(object):
 
     # CRUD
     def find(self, spec=None, fields=None, skip=None, limit=None, sort=None,
-             as_dict=False, **kwargs):
+             as_dict=False, lazy=False, prefetch=None, cached=False,
+             lookup=None, **kwargs):
+        """
+        :param lazy: if True, values of returned documents are converted
+            on first access, see ``Document.from_mongo``;
+        :param prefetch: number of batches to read ahead in background
+            thread, see ``CursorWrapper``;
+        :param fields: projection, partial documents are returned if
+            specified, see ``Document.from_mongo``;
+        :param cached: if True, list of results is returned, it's taken
+            from ``query_cache`` of the collection if the same query was
+            made since the last write;
+        :param lookup: names of reference fields (see ``ReferenceField``)
+            resolved by the server with $lookup, so results and
+            referenced documents are fetched with single aggregation,
+            other keyword arguments are passed to ``aggregate`` then.
+        """
+        if lookup:
+            return self._find_with_lookup(
+                spec, fields, skip, limit, sort, lookup, as_dict, lazy,
+                prefetch, **kwargs)
         find_specs = {
             name: val
             for name, val
@@ -108,24 +715,294 @@ class Collection(object):
             if val
         }
         find_specs.update(kwargs)
+        if cached:
+            return self._find_cached(find_specs, as_dict, lazy, fields)
         result = self.collection.find(**find_specs)
         if not as_dict:
-            result = CursorWrapper(result, self.serialize)
+            serialize = partial(
+                self.serialize, lazy=lazy,
+                fields=self.model_class.get_projection(fields))
+            result = CursorWrapper(result, serialize, prefetch)
+        elif prefetch:
+            result = CursorWrapper(result, prefetch=prefetch)
         return result
 
-    def get(self, spec_or_id=None, fields=None):
+    def _find_with_lookup(self, spec, fields, skip, limit, sort, lookup,
+                          as_dict, lazy, prefetch, **kwargs):
+        pipeline = []
+        if spec:
+            pipeline.append({'$match': spec})
+        if sort:
+            pipeline.append({'$sort': SON(sort)})
+        if skip:
+            pipeline.append({'$skip': skip})
+        if limit:
+            pipeline.append({'$limit': limit})
+        if fields:
+            if not isinstance(fields, dict):
+                fields = dict.fromkeys(fields, 1)
+            pipeline.append({'$project': fields})
+
+        lookups = []
+        for name in lookup:
+            field = getattr(self.model_class, name, None)
+            if not hasattr(field, 'resolve'):
+                raise ValueError('{} is not a reference field of {}'.format(
+                    name, self.model_class.__name__))
+            target = field.model_class.objects
+            if target.db_name != self.db_name:
+                raise ValueError(
+                    '$lookup of {} requires collections in the same '
+                    'database'.format(name))
+            alias = '__lookup_{}'.format(field.name)
+            pipeline.append({'$lookup': {
+                'from': target.collection.name,
+                'localField': field.name,
+                'foreignField': '_id',
+                'as': alias,
+            }})
+            lookups.append((field, field.model_class, alias))
+
+        result = self.aggregate(pipeline, **kwargs)
+        if as_dict:
+            return CursorWrapper(result, prefetch=prefetch)
+
+        from_mongo = self.model_class.from_mongo
+        projection = self.model_class.get_projection(fields)
+
+        def serialize(payload):
+            found = [
+                (field, model_class, payload.pop(alias, None))
+                for field, model_class, alias in lookups]
+            doc = from_mongo(payload, lazy, projection)
+            for field, model_class, referenced in found:
+                if referenced:
+                    field.resolve(doc, model_class.from_mongo(referenced[0]))
+            return doc
+        return CursorWrapper(result, serialize, prefetch)
+
+    def _find_cached(self, find_specs, as_dict, lazy, fields):
+        cache = self.query_cache
+        raw = key = version = None
+        if cache is not None:
+            try:
+                key = canonical_key(**find_specs)
+            except TypeError:
+                pass
+            else:
+                version = cache.version
+                raw = cache.get(key)
+
+        if raw is None:
+            payloads = list(self.collection.find(**find_specs))
+            if key is not None:
+                # encoded payloads are compact and can't be changed
+                # through returned results
+                cache.set(
+                    key, [BSON.encode(payload) for payload in payloads],
+                    version)
+        else:
+            payloads = [BSON(item).decode() for item in raw]
+
+        if as_dict:
+            return payloads
+        return self.serialize(payloads, lazy, fields)
+
+    def parallel_scan(self, spec=None, workers=4, fields=None,
+                      as_dict=False, lazy=False, batches=False,
+                      batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Iterates over documents matching ``spec`` with ``workers`` cursors
+        read by background threads at the same time, each one over its
+        own range of ``_id``, for full collection jobs like exports or
+        backfills. Results are yielded in order of arrival, not sorted.
+        See ``_scan_ranges`` for how ranges are chosen.
+        :param fields: projection, see ``find``;
+        :param batches: if True, lists of at most ``batch_size`` documents
+            are yielded as read by workers instead of single documents;
+        :param batch_size: number of documents read by worker at once,
+            at most ``2 * workers`` batches are kept in memory;
+        :return: generator, closing it stops the workers.
+        """
+        if workers < 1:
+            raise ValueError('workers must be positive')
+        specs = self._scan_ranges(spec, workers)
+        serialize = None
+        if not as_dict:
+            serialize = partial(
+                self.serialize, lazy=lazy,
+                fields=self.model_class.get_projection(fields))
+
+        def scan(range_spec):
+            cursor = self.collection.find(range_spec, fields)
+            for batch in _read_batches(
+                    cursor.batch_size(batch_size), batch_size):
+                yield serialize(batch) if serialize else batch
+
+        def iterate():
+            reader = _BackgroundReader(
+                [partial(scan, range_spec) for range_spec in specs],
+                2 * workers)
+            try:
+                for batch in reader:
+                    if batches:
+                        yield batch
+                    else:
+                        for doc in batch:
+                            yield doc
+            finally:
+                reader.close()
+        return iterate()
+
+    def _scan_ranges(self, spec, parts):
+        """
+        Returns up to ``parts`` queries selecting documents matching
+        ``spec`` by adjacent ranges of ``_id``. For ObjectId keys the time
+        between the first and the last one is divided evenly, which costs
+        two index lookups and is balanced for steady insert rate. For
+        other keys split points are read from ``_id`` index with skip.
+        Keys of different types are not split, as range conditions of
+        mongo match values of the same type only.
+        """
+        def first(direction, skip=0):
+            cursor = self.collection.find(spec, {'_id': 1})
+            cursor = cursor.sort('_id', direction).skip(skip).limit(1)
+            for payload in cursor:
+                return payload['_id']
+            return None
+
+        low = first(1)
+        high = first(-1)
+        bounds = []
+        if parts > 1 and low is not None and type(low) is type(high):
+            if isinstance(low, ObjectId):
+                start = low.generation_time
+                step = (high.generation_time - start) / parts
+                bounds = [
+                    ObjectId.from_datetime(start + step * i)
+                    for i in range(1, parts)]
+            else:
+                total = self.collection.find(spec).count()
+                bounds = [
+                    first(1, total * i // parts) for i in range(1, parts)]
+            if any(type(bound) is not type(low) for bound in bounds):
+                bounds = []
+        # equal split points would give empty ranges
+        bounds = [
+            bound for i, bound in enumerate(bounds)
+            if i == 0 or bound != bounds[i - 1]]
+
+        specs = []
+        for lower, upper in zip([None] + bounds, bounds + [None]):
+            condition = {}
+            if lower is not None:
+                condition['$gte'] = lower
+            if upper is not None:
+                condition['$lt'] = upper
+            if not condition:
+                specs.append(spec or {})
+            elif spec:
+                specs.append({'$and': [spec, {'_id': condition}]})
+            else:
+                specs.append({'_id': condition})
+        return specs
+
+    def get(self, spec_or_id=None, fields=None, lazy=False):
         if spec_or_id and not isinstance(spec_or_id, dict):
             spec_or_id = ObjectId(spec_or_id)
-        get_specs = {
-            name: val for name, val
-            in (('spec_or_id', spec_or_id), ('fields', fields))
-            if val
-        }
-        return self.serialize(self.collection.find_one(**get_specs))
+        identity_map = self._identity_map
+        if identity_map is not None and isinstance(spec_or_id, ObjectId):
+            doc = identity_map.get(spec_or_id)
+            if doc is not None:
+                return doc
+
+        cache = self.cache
+        if cache is not None and not fields and \
+                isinstance(spec_or_id, ObjectId):
+            version = cache.version
+            cached = cache.get(spec_or_id)
+            if cached is not None:
+                result = self._copy_loaded(cached)
+            else:
+                result = self.serialize(
+                    self.collection.find_one(spec_or_id=spec_or_id))
+                if result is not None:
+                    cache.set(spec_or_id, self._copy_loaded(result), version)
+        else:
+            get_specs = {
+                name: val for name, val
+                in (('spec_or_id', spec_or_id), ('fields', fields))
+                if val
+            }
+            result = self.serialize(
+                self.collection.find_one(**get_specs), lazy, fields)
+
+        # partial documents could have _id excluded by projection
+        if identity_map is not None and result is not None and \
+                not result.is_partial and result._id:
+            result = identity_map.setdefault(result._id, result)
+        return result
+
+    def get_many(self, ids, fields=None, lazy=False,
+                 chunk_size=DEFAULT_IN_CHUNK_SIZE):
+        """
+        Loads documents by ids with one $in query per ``chunk_size`` ids,
+        the identity map and the cache are consulted first like in
+        ``get``.
+        :return: list of documents in order of ``ids``, None for missing
+            ones.
+        """
+        ids = [
+            _id if isinstance(_id, ObjectId) else ObjectId(_id)
+            for _id in ids]
+        if isinstance(fields, dict) and not fields.get('_id', 1):
+            # results are matched to ids, so _id is loaded anyway
+            fields = dict(fields)
+            del fields['_id']
+        identity_map = self._identity_map
+        cache = self.cache if not fields else None
+        version = cache.version if cache is not None else None
+
+        found = {}
+        missing = []
+        for _id in OrderedDict.fromkeys(ids):
+            doc = None
+            if identity_map is not None:
+                doc = identity_map.get(_id)
+            if doc is None and cache is not None:
+                cached = cache.get(_id)
+                if cached is not None:
+                    doc = self._copy_loaded(cached)
+            if doc is None:
+                missing.append(_id)
+            else:
+                found[_id] = doc
+
+        for start in range(0, len(missing), chunk_size):
+            find_specs = {
+                'spec': {'_id': {'$in': missing[start:start + chunk_size]}}}
+            if fields:
+                find_specs['fields'] = fields
+            docs = self.serialize(
+                list(self.collection.find(**find_specs)),
+                lazy and cache is None, fields)
+            for doc in docs:
+                if cache is not None:
+                    cache.set(doc._id, self._copy_loaded(doc), version)
+                if identity_map is not None and not doc.is_partial:
+                    doc = identity_map.setdefault(doc._id, doc)
+                found[doc._id] = doc
+        return [found.get(_id) for _id in ids]
+
+    def loader(self, chunk_size=DEFAULT_IN_CHUNK_SIZE):
+        """
+        Returns ``BatchLoader`` which coalesces lookups by id.
+        """
+        return BatchLoader(self, chunk_size)
 
-    def get_or_raise(self, spec_or_id=None, fields=None):
+    def get_or_raise(self, spec_or_id=None, fields=None, lazy=False):
         try:
-            result = self.get(spec_or_id, fields)
+            result = self.get(spec_or_id, fields, lazy)
         # TypeError is required because of bug in bson lib.
         # It throws TypeError when unicode is passed to ObjectId constructor.
         except (InvalidId, TypeError):
@@ -136,9 +1013,34 @@ class Collection(object):
 
         return result
 
-    def count(self, spec=None):
+    def count(self, spec=None, limit=None, max_time_ms=None):
+        """
+        :param limit: counting stops at this number, so "more than N"
+            check doesn't need to visit all matching documents;
+        :param max_time_ms: time limit of counting on the server.
+        """
+        cache = self.count_cache
+        key = version = None
+        if cache is not None:
+            try:
+                key = canonical_key(spec=spec or {}, limit=limit)
+            except TypeError:
+                pass
+            else:
+                version = cache.version
+                count = cache.get(key)
+                if count is not None:
+                    return count
+
         qs = self.collection.find(spec)
-        count = qs.count()
+        if limit:
+            qs.limit(limit)
+        if max_time_ms:
+            qs.max_time_ms(max_time_ms)
+        count = qs.count(with_limit_and_skip=bool(limit))
+
+        if key is not None:
+            cache.set(key, count, version)
         return count
 
     def create(self, payload):
@@ -159,40 +1061,216 @@ class Collection(object):
         if not isinstance(spec_or_id, dict):
             spec_or_id = {'_id': ObjectId(spec_or_id)}
         if isinstance(document, Document):
-            document_as_dict = document.to_mongo()
+            document_as_dict = self._to_replacement(document)
             is_doc = True
         else:
             document_as_dict = document
         result = self.collection.update(
             spec_or_id, document_as_dict, upsert=upsert, multi=multi, w=w)
-        if is_doc and 'upserted' in result:
-            document._id = result['upserted']
+        self._invalidate(spec_or_id)
+        if is_doc:
+            if 'upserted' in result:
+                document._id = result['upserted']
+            if document._id:
+                document._mark_stored(document=document_as_dict)
         return result
 
     def save(self, doc, w=1):
+        """
+        New documents are stored as a whole, for loaded or already saved
+        ones only changed fields are sent with $set/$unset update. Partial
+        documents could be saved only this way. If loaded document was
+        removed meanwhile, it's stored again as a whole, partial ones
+        raise ``DoesNotExist`` then.
+        """
         doc.validate()
-        result = self.collection.save(doc.to_mongo(), w=w)
-        if not doc._id:
-            doc._id = result
+        if self._can_update(doc):
+            update = doc.to_mongo_update()
+            doc_as_dict = None
+            if update:
+                status = self.collection.update(
+                    {'_id': doc._id}, update, w=w)
+                # nothing is reported for unacknowledged writes
+                if status is not None and not status.get('n'):
+                    doc_as_dict = self._to_recreated(doc)
+                    self.collection.save(doc_as_dict, w=w)
+            result = doc._id
+            doc._mark_stored(update, doc_as_dict)
+        else:
+            doc_as_dict = self._to_replacement(doc)
+            result = self.collection.save(doc_as_dict, w=w)
+            if not doc._id:
+                doc._id = result
+            doc._mark_stored(document=doc_as_dict)
+        self._invalidate(doc._id)
+        identity_map = self._identity_map
+        if identity_map is not None and not doc.is_partial:
+            identity_map[doc._id] = doc
         return result
 
-    def insert(self, doc_or_docs, **kwargs):
+    def bulk(self, ordered=True, w=1):
+        """
+        Returns ``Bulk`` unit of work, queued saves, inserts, updates and
+        removes are sent with a few round trips instead of one per
+        operation::
+
+            with Model.objects.bulk() as bulk:
+                for doc in docs:
+                    bulk.save(doc)
+            assert bulk.result.ok
+        """
+        return Bulk(self, ordered, w)
+
+    def validate_many(self, docs):
+        """
+        Validates all documents collecting all errors instead of raising.
+        :param docs: iterable of documents;
+        :return: dict of document index -> list of ``ValidationError``,
+            only invalid documents are included.
+        """
+        report = {}
+        for index, doc in enumerate(docs):
+            errors = doc.validation_errors()
+            if errors:
+                report[index] = errors
+        return report
+
+    def insert(self, doc_or_docs, on_invalid=None, **kwargs):
+        """
+        :param doc_or_docs: document or iterable of documents;
+        :param on_invalid: if None first invalid document raises
+            ``ValidationError``, otherwise invalid documents are skipped and
+            passed to this callable as list of (document, errors) pairs,
+            so they could be logged or quarantined.
+        """
         if isinstance(doc_or_docs, Document):
             doc_or_docs = [doc_or_docs]
         else:
             doc_or_docs = list(doc_or_docs)
 
-        for doc in doc_or_docs:
-            doc.validate()
-        entities = [(doc, doc.to_mongo()) for doc in doc_or_docs]
-        result = self.collection.insert(
-            [doc_as_dict for _, doc_as_dict in entities], **kwargs
-        )
+        entities = self._prepare_insert(doc_or_docs, on_invalid)
+        if not entities:
+            return []
+        try:
+            result = self.collection.insert(
+                [doc_as_dict for _, doc_as_dict in entities], **kwargs
+            )
+        finally:
+            self._invalidate_queries()
         if kwargs.get('manipulate') is not False:
-            for doc, doc_as_dict in entities:
-                doc._id = doc_as_dict['_id']
+            self._mark_inserted(entities)
         return result
 
+    def _prepare_insert(self, docs, on_invalid):
+        # validates list of documents and encodes the valid ones
+        if on_invalid is None:
+            for doc in docs:
+                doc.validate()
+        else:
+            report = self.validate_many(docs)
+            if report:
+                on_invalid([
+                    (docs[index], errors)
+                    for index, errors in sorted(report.items())])
+                docs = [
+                    doc for index, doc in enumerate(docs)
+                    if index not in report]
+        return [(doc, self._to_replacement(doc)) for doc in docs]
+
+    @staticmethod
+    def _mark_inserted(entities):
+        for doc, doc_as_dict in entities:
+            doc._id = doc_as_dict['_id']
+            doc._mark_stored()
+
+    def insert_stream(self, docs, chunk_size=DEFAULT_INSERT_CHUNK_SIZE,
+                      concurrency=1, on_invalid=None, progress=None,
+                      **kwargs):
+        """
+        Validates, encodes and inserts documents from iterable chunk by
+        chunk, so memory usage doesn't depend on the size of input.
+        Chunks failed to insert don't stop the process, they may be
+        inserted in part.
+        :param docs: iterable of documents, for example generator;
+        :param chunk_size: number of documents inserted at once;
+        :param concurrency: number of chunks inserted at the same time
+            by background threads, at most ``2 * concurrency`` chunks are
+            kept in memory;
+        :param on_invalid: see ``insert``;
+        :param progress: callable receiving total number of documents
+            inserted so far after each chunk;
+        :return: list of (chunk number, documents, exception) of failed
+            chunks.
+        """
+        failed = []
+        counter = [0]
+        manipulate = kwargs.get('manipulate') is not False
+
+        def insert_chunk(number, entities):
+            try:
+                self.collection.insert(
+                    [doc_as_dict for _, doc_as_dict in entities], **kwargs)
+            except Exception as ex:
+                # not only PyMongoError, for example InvalidDocument is
+                # raised by bson, worker thread must survive any of them
+                return number, entities, ex
+            return number, entities, None
+
+        def handle(number, entities, error):
+            self._invalidate_queries()
+            if error is not None:
+                failed.append((number, [doc for doc, _ in entities], error))
+                return
+            if manipulate:
+                self._mark_inserted(entities)
+            counter[0] += len(entities)
+            if progress is not None:
+                progress(counter[0])
+
+        tasks = queue.Queue(concurrency)
+        results = queue.Queue()
+
+        def work():
+            while True:
+                task = tasks.get()
+                if task is _DONE:
+                    return
+                results.put(insert_chunk(*task))
+
+        workers = []
+        if concurrency > 1:
+            for _ in range(concurrency):
+                worker = threading.Thread(target=work)
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+
+        docs = iter(docs)
+        number = 0
+        try:
+            while True:
+                chunk = list(islice(docs, chunk_size))
+                if not chunk:
+                    break
+                entities = self._prepare_insert(chunk, on_invalid)
+                if entities and workers:
+                    tasks.put((number, entities))
+                elif entities:
+                    handle(*insert_chunk(number, entities))
+                number += 1
+                while not results.empty():
+                    handle(*results.get())
+        finally:
+            for _ in workers:
+                tasks.put(_DONE)
+            for worker in workers:
+                worker.join()
+            # chunks inserted before an error are handled as well
+            while not results.empty():
+                handle(*results.get())
+        failed.sort(key=lambda item: item[0])
+        return failed
+
     def find_and_modify(self, spec_or_id, document, **kwargs):
         """
         @param spec_or_id: filter for updating (default is ``{}``)
@@ -216,22 +1294,27 @@ class Collection(object):
         if not isinstance(spec_or_id, dict):
             spec_or_id = {'_id': ObjectId(spec_or_id)}
         if isinstance(document, Document):
-            document_as_dict = document.to_mongo()
+            document_as_dict = self._to_replacement(document)
         else:
             document_as_dict = document
         result = self.collection.find_and_modify(
             spec_or_id, document_as_dict, **kwargs)
+        self._invalidate(spec_or_id)
         if kwargs.get('full_response'):
             return result
-        return self.serialize(result)
+        return self.serialize(result, fields=kwargs.get('fields'))
 
     def remove(self, spec_or_id=None, w=1):
         if isinstance(spec_or_id, Document):
+            # the whole document has to be written if saved again
+            spec_or_id._changed = None
             spec_or_id = spec_or_id._id
         if (spec_or_id and not isinstance(spec_or_id, dict) and
                 isinstance(spec_or_id, string_types)):
             spec_or_id = ObjectId(spec_or_id)
-        return self.collection.remove(spec_or_id, w=w)
+        result = self.collection.remove(spec_or_id, w=w)
+        self._invalidate(spec_or_id)
+        return result
 
     def aggregate(self, pipeline, **kwargs):
         default_kwargs = {'cursor': {}}
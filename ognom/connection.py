@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 import logging
+from importlib import import_module
 from time import sleep
 
 from six import string_types
@@ -10,6 +11,11 @@ from pymongo.errors import ConnectionFailure
 MAX_ATTEMPTS = 20
 CONNECT_SLEEP_TIME = 1
 
+# client classes which could be chosen by the 'backend' setting
+BACKENDS = {
+    'memory': 'ognom.memory.MemoryClient',
+}
+
 
 class ConnectionManager(object):
     databases = {}
@@ -46,6 +52,12 @@ class ConnectionManager(object):
             connection = cls._establish_connection(configuration)
         elif isinstance(configuration, list):
             connection = cls._establish_connection(*configuration)
+        elif isinstance(configuration, dict) and \
+                configuration.get('backend'):
+            backend = cls._get_backend(configuration['backend'])
+            connection = backend(
+                *configuration.get('args', []),
+                **configuration.get('kwargs', {}))
         elif isinstance(configuration, dict):
             connection = cls._establish_connection(
                 *configuration.get('args', []),
@@ -55,6 +67,23 @@ class ConnectionManager(object):
                 'Unsupported configuration format: %s' % configuration)
         return connection
 
+    @classmethod
+    def _get_backend(cls, backend):
+        """
+        Returns client class for the 'backend' setting: name from
+        ``BACKENDS``, dotted path or the class itself. Client has to
+        provide databases as attributes, databases - collections, and
+        collections - methods of pymongo 2 ``Collection`` used by
+        ``ognom.collection.Collection``, see ``ognom.memory``.
+        """
+        if not isinstance(backend, string_types):
+            return backend
+        path = BACKENDS.get(backend, backend)
+        module_name, _, class_name = path.rpartition('.')
+        if not module_name:
+            raise ValueError('Unsupported backend: %s' % backend)
+        return getattr(import_module(module_name), class_name)
+
     @classmethod
     def _establish_connection(cls, *args, **kwargs):
         for i in range(MAX_ATTEMPTS - 1):
@@ -1,17 +1,292 @@
 from __future__ import unicode_literals
 import copy
+import hashlib
+import struct
+from collections import OrderedDict, namedtuple
 
-from bson import ObjectId
+from bson import BSON, ObjectId
+from bson.errors import InvalidDocument, InvalidId
 from six import with_metaclass
 
 from ognom.fields import GenericField, ObjectIdField, ValidationError
 from ognom._registry import register_doc_class
+from ognom._storage import LazyData, SlotStore, make_slot_store, slot_name
 
 
 class ObjectDoesNotExist(Exception):
     pass
 
 
+# fields loaded by a projected query, ``partial`` ones were loaded only
+# in part (dotted paths, $slice and so on)
+Projection = namedtuple('Projection', ['loaded', 'partial'])
+
+# shared by all clean documents as their ``_changed`` set, field
+# descriptors replace it with a new set on first assignment
+NO_CHANGES = frozenset()
+
+
+def _fingerprint(name, value):
+    # values of mutable fields are compared with stored ones by digest of
+    # their BSON, so documents don't keep copies of them; unlike hash()
+    # it's the same in all processes, so it could be pickled
+    try:
+        data = BSON.encode({name: value})
+    except (InvalidDocument, TypeError, ValueError):
+        return None
+    return struct.unpack(str('<q'), hashlib.md5(data).digest()[:8])[0]
+
+
+def _parse_projection(doc_cls, fields):
+    if isinstance(fields, dict):
+        spec = fields
+    else:
+        spec = dict.fromkeys(fields, 1)
+    # projection operators like $slice don't define projection mode
+    modes = [
+        value for path, value in spec.items()
+        if path != '_id' and not isinstance(value, dict)]
+    inclusion = bool(modes[0]) if modes else bool(spec.get('_id'))
+
+    loaded = set()
+    partial = set()
+    if not inclusion:
+        loaded.update(field.name for field in doc_cls._fields.values())
+    for path, value in spec.items():
+        name = path.split('.', 1)[0]
+        if isinstance(value, dict) or '.' in path:
+            partial.add(name)
+            loaded.add(name)
+        elif value:
+            loaded.add(name)
+        else:
+            loaded.discard(name)
+    if inclusion and spec.get('_id', 1):
+        loaded.add('_id')
+    return Projection(frozenset(loaded), frozenset(partial))
+
+
+def _collect_fields(doc_cls):
+    fields = OrderedDict()
+    for klass in reversed(doc_cls.__mro__):
+        for name, value in klass.__dict__.items():
+            if isinstance(value, GenericField):
+                fields[name] = value
+            else:
+                fields.pop(name, None)
+    return fields
+
+
+def _compile_mongo_encoder(doc_cls):
+    encoders = {
+        name: field.mongo_encoder()
+        for name, field in doc_cls._fields.items()
+    }
+    # values of compact documents are read from slots directly
+    slot_plan = tuple(
+        (field.name, slot_name(field.name), encoders[name])
+        for name, field in doc_cls._fields.items())
+
+    def encode_slots(data):
+        result = {}
+        for name, slot, encoder in slot_plan:
+            value = getattr(data, slot, None)
+            if value is None:
+                continue
+            if encoder is None:
+                result[name] = value
+            else:
+                result[name] = encoder(value)
+        if data._extra:
+            result.update(encode(data._extra))
+        return result
+
+    def encode(data):
+        if data.__class__ is not dict:
+            if isinstance(data, SlotStore):
+                return encode_slots(data)
+            if isinstance(data, LazyData):
+                result = encode(data.data)
+                # untouched values are still in their mongo representation
+                for name, value in data.raw.items():
+                    if value is not None:
+                        result[name] = value
+                return result
+
+        result = {}
+        for name, value in data.items():
+            if value is None:
+                continue
+
+            try:
+                encoder = encoders[name]
+            except KeyError:
+                attribute = getattr(doc_cls, name, None)
+                if attribute:
+                    result[name] = attribute.to_mongo(value)
+                elif name == '_id' and value:
+                    result[name] = value
+                continue
+
+            if encoder is None:
+                result[name] = value
+            else:
+                result[name] = encoder(value)
+        return result
+    return encode
+
+
+def _compile_json_encoder(doc_cls):
+    encoders = {
+        field.name: field.json_encoder()
+        for field in doc_cls._fields.values()
+    }
+
+    def encode(data):
+        result = {}
+        for name, value in data.items():
+            if value is None:
+                continue
+
+            if name == '_id' and value:
+                result['id'] = str(value)
+                continue
+
+            encoder = encoders.get(name)
+            if encoder is None:
+                result[name] = value
+            else:
+                result[name] = encoder(value)
+        return result
+    return encode
+
+
+def _compile_json_decoder(doc_cls):
+    decoders = {
+        name: field.from_json
+        for name, field in doc_cls._fields.items()
+        if name != '_id'
+    }
+
+    def decode(payload):
+        result = {}
+        if not payload:
+            return result
+
+        key = None
+        try:
+            for key, value in payload.items():
+                decoder = decoders.get(key)
+                if decoder is not None:
+                    result[key] = decoder(value)
+                elif key in ('id', '_id') and value:
+                    result['_id'] = ObjectId(value)
+        except (ValueError, TypeError, InvalidId) as ex:
+            if key == 'id':
+                key = '_id'
+            raise ValidationError(repr(ex), key)
+        return result
+    return decode
+
+
+def _compile_data_copier(doc_cls):
+    copiers = {
+        field.name: field.value_copier()
+        for field in doc_cls._fields.values()
+    }
+    data_factory = doc_cls._data_factory
+
+    def copy_data(data):
+        result = data_factory()
+        for name, value in data.items():
+            try:
+                copier = copiers[name]
+            except KeyError:
+                result[name] = copy.deepcopy(value)
+                continue
+
+            if copier is None or value is None:
+                result[name] = value
+            else:
+                result[name] = copier(value)
+        return result
+    return copy_data
+
+
+def _compile_mongo_decoder(doc_cls):
+    data_factory = doc_cls._data_factory
+    # values of compact documents are written to slots directly
+    decoders = {
+        name: (
+            field.name, field._slot,
+            field.mongo_decoder(), field.mutable)
+        for name, field in doc_cls._fields.items()
+    }
+    lazy_decoders = {
+        data_key: decoder
+        for data_key, _, decoder, _ in decoders.values()
+        if decoder is not None
+    }
+    defaults = doc_cls._defaults
+
+    def decode_unknown(instance, key, value):
+        attribute = getattr(doc_cls, key, None)
+        if attribute and hasattr(attribute, 'from_mongo'):
+            setattr(instance, key, attribute.from_mongo(value))
+        elif key == '_id' and value:
+            setattr(instance, key, value)
+
+    def decode(payload, lazy=False, projection=None, fingerprints=True):
+        # values from mongo are already in assignable form, so instance is
+        # filled directly bypassing __new__ and field descriptors
+        instance = object.__new__(doc_cls)
+        instance._changed = NO_CHANGES
+        instance._projection = projection
+        data = instance._data = data_factory()
+        # to find out which mutable fields were changed in place, not
+        # needed for embedded documents which are never saved on their own
+        fingerprints = instance._fingerprints = {} if fingerprints else None
+        raw = {}
+        if lazy:
+            instance._data = LazyData(raw, data, lazy_decoders)
+
+        for key, value in payload.items():
+            try:
+                data_key, slot, decoder, mutable = decoders[key]
+            except KeyError:
+                decode_unknown(instance, key, value)
+                continue
+
+            if mutable and fingerprints is not None:
+                fingerprints[data_key] = _fingerprint(data_key, value)
+            if decoder is not None:
+                if lazy:
+                    raw[data_key] = value
+                    continue
+                value = decoder(value)
+            if slot is None:
+                data[data_key] = value
+            else:
+                setattr(data, slot, value)
+
+        loaded = None
+        if projection is not None:
+            loaded = projection.loaded
+            # values loaded in part don't tell what is stored
+            if fingerprints:
+                for key in projection.partial:
+                    fingerprints.pop(key, None)
+        for key, value in defaults.items():
+            if key not in data and key not in raw and (
+                    loaded is None or key in loaded):
+                if callable(value):
+                    data[key] = value()
+                else:
+                    data[key] = value
+        return instance
+    return decode
+
+
 class MongoDocumentMeta(type):
     def __new__(cls, class_name, bases, dct):
         result_cls = type.__new__(cls, class_name, bases, dct)
@@ -51,22 +326,74 @@ class MongoDocumentMeta(type):
                     result_cls._required.add(name)
                 if value.default is not None:
                     result_cls._defaults[name] = value.default
+
+        result_cls._fields = _collect_fields(result_cls)
+        # compact storage is enabled by __slots__ declared in a subclass
+        # of Document, and then inherited by all its descendants
+        if result_cls._data_factory is not dict or (
+                '__slots__' in dct and
+                any(isinstance(base, MongoDocumentMeta) for base in bases)):
+            # fields of compact classes access slots of the store directly,
+            # inherited from ordinary classes are replaced by own copies
+            for name, field in result_cls._fields.items():
+                if field._slot is None:
+                    if name not in dct:
+                        field = copy.copy(field)
+                        setattr(result_cls, name, field)
+                    field._slot = slot_name(field.name)
+            result_cls._fields = _collect_fields(result_cls)
+            result_cls._data_factory = make_slot_store(
+                '{}Store'.format(class_name),
+                [field.name for field in result_cls._fields.values()])
+        result_cls._validation_plan = tuple(
+            (field.name, field, bool(field.required),
+             set(field.choices) if field.choices else None)
+            for field in result_cls._fields.values())
+        result_cls._mutable = frozenset(
+            field.name for field in result_cls._fields.values()
+            if field.mutable)
+        result_cls._encode_mongo = staticmethod(
+            _compile_mongo_encoder(result_cls))
+        result_cls._encode_json = staticmethod(
+            _compile_json_encoder(result_cls))
+        result_cls._decode_json = staticmethod(
+            _compile_json_decoder(result_cls))
+        result_cls._copy_data = staticmethod(
+            _compile_data_copier(result_cls))
+        result_cls._decode_mongo = staticmethod(
+            _compile_mongo_decoder(result_cls))
         return result_cls
 
 
 class Document(with_metaclass(MongoDocumentMeta, object)):
+    __slots__ = (
+        '_data', '_changed', '_projection', '_fingerprints', '__weakref__')
+
     _id = ObjectIdField()
 
     _required = None
     _defaults = None
     _choices = None
+    _fields = None
+    _mutable = None
+    _validation_plan = None
+    _encode_mongo = None
+    _encode_json = None
+    _decode_json = None
+    _copy_data = None
+    _decode_mongo = None
+    _data_factory = dict
     DoesNotExist = None
 
     objects = None  # repository can be injected here
 
     def __new__(cls, *args, **kwargs):
         instance = super(Document, cls).__new__(cls)
-        instance._data = {}
+        instance._data = cls._data_factory()
+        # changes are tracked only for loaded or saved documents
+        instance._changed = None
+        instance._projection = None
+        instance._fingerprints = None
         instance.apply_defaults()
         return instance
 
@@ -79,6 +406,14 @@ class Document(with_metaclass(MongoDocumentMeta, object)):
     def id(self):
         return self._id
 
+    @property
+    def is_partial(self):
+        """
+        True if document was loaded by a query with projection, so only
+        some of its fields are available.
+        """
+        return self._projection is not None
+
     def apply_defaults(self):
         for key, value in self._defaults.items():
             if key not in self._data:
@@ -88,89 +423,205 @@ class Document(with_metaclass(MongoDocumentMeta, object)):
                     self._data[key] = value
 
     def validate(self):
-        for required_field in self._required:
-            if self._data.get(required_field) is None:
-                raise ValidationError(
-                    'Field {} is missing'.format(required_field),
-                    required_field)
-
-        for name, choices in self._choices.items():
-            if (name in self._data and
-                    self._data[name] is not None and
-                    self._data[name] not in choices):
-                raise ValidationError(
-                    'Field {} value {} is not included in {}'.format(
-                        name, self._data[name], choices))
-
-        for name, value in self._data.items():
-            if value is None and name not in self._required:
+        """
+        Checks values by validation plan compiled for the class. For loaded
+        and saved documents fields not changed since then are skipped,
+        fields of mutable types are skipped if their value is the same as
+        loaded or saved one, untouched in lazy documents or not loaded in
+        partial ones.
+        """
+        for error in self._iter_validation_errors():
+            raise error
+
+    def validation_errors(self):
+        """
+        Same as ``validate`` but returns list of all errors found instead
+        of raising the first one.
+        """
+        return list(self._iter_validation_errors())
+
+    def _iter_validation_errors(self):
+        data = self._data
+        pending = self._changed
+        untouched = data.raw if isinstance(data, LazyData) else ()
+        projection = self._projection
+        loaded = projection.loaded if projection is not None else None
+        for name, field, required, choices in self._validation_plan:
+            if pending is not None and name not in pending and (
+                    not field.mutable or name in untouched or (
+                        loaded is not None and name not in loaded)):
                 continue
 
-            attribute = self.__class__.__dict__.get(name)
-            if attribute:
-                attribute.validate(value)
+            value = data.get(name)
+            if pending is not None and name not in pending and \
+                    self._is_stored(name, value):
+                continue
 
-    def to_mongo(self):
-        result = {}
-        for name, value in self._data.items():
             if value is None:
+                if required:
+                    yield ValidationError(
+                        'Field {} is missing'.format(name), name)
                 continue
 
-            attribute = getattr(self.__class__, name, None)
-            if attribute:
-                result[name] = attribute.to_mongo(value)
-            elif name == '_id' and value:
-                result[name] = value
-        return result
+            if choices is not None and value not in choices:
+                yield ValidationError(
+                    'Field {} value {} is not included in {}'.format(
+                        name, value, choices), name)
+                continue
+
+            try:
+                field.validate(value)
+            except ValidationError as ex:
+                yield ex
+
+    def _is_stored(self, name, value):
+        # whether value of mutable field is the same as loaded or saved one
+        fingerprints = self._fingerprints
+        if not fingerprints or value is None or name not in fingerprints:
+            return False
+        try:
+            encoded = self._encode_mongo({name: value})
+        except (ValidationError, ValueError, TypeError):
+            return False
+        return fingerprints[name] == _fingerprint(name, encoded.get(name))
+
+    def to_mongo(self):
+        return self._encode_mongo(self._data)
+
+    def to_mongo_update(self):
+        """
+        Returns update in mongo notation for fields changed since
+        document was loaded or saved. Fields of mutable types could be
+        changed in place, so they are included if their value differs
+        from the loaded or saved one, or if that one is not known. The
+        ones which were not touched at all in lazy documents or were
+        loaded only in part in partial documents are skipped.
+        """
+        data = self._data
+        names = set(name for name in self._mutable if name in data)
+        if isinstance(data, LazyData):
+            names.difference_update(data.raw)
+        if self._projection is not None:
+            names.difference_update(self._projection.partial)
+        names.update(self._changed)
+        names.discard('_id')
+
+        values = {}
+        unset = {}
+        for name in names:
+            value = data.get(name)
+            if value is None:
+                unset[name] = ''
+            else:
+                values[name] = value
+
+        update = {}
+        if values:
+            values = self._encode_mongo(values)
+            fingerprints = self._fingerprints
+            if fingerprints:
+                for name in [
+                        name for name, value in values.items()
+                        if name in fingerprints and
+                        fingerprints[name] == _fingerprint(name, value)]:
+                    del values[name]
+        if values:
+            update['$set'] = values
+        if unset:
+            update['$unset'] = unset
+        return update
+
+    def _mark_stored(self, update=None, document=None):
+        """
+        Called by collection when document was written, either as a
+        whole, then ``document`` is its mongo representation, or with
+        ``update`` returned by ``to_mongo_update``. Fingerprints of
+        written values of mutable fields are kept to find out whether they
+        are changed in place, if neither is given they are sent on the
+        next save.
+        """
+        self._changed = NO_CHANGES
+        mutable = self._mutable
+        if document is not None:
+            fingerprints = {}
+            values = document
+        elif update is not None:
+            fingerprints = dict(self._fingerprints or ())
+            for name in update.get('$unset', ()):
+                fingerprints.pop(name, None)
+            values = update.get('$set', {})
+        else:
+            self._fingerprints = None
+            return
+        for name, value in values.items():
+            if name in mutable:
+                fingerprints[name] = _fingerprint(name, value)
+        self._fingerprints = fingerprints
 
     def _get_prepared_data(self):
         return self._data
 
     def jsonify(self):
-        result = {}
-        for name, value in self._get_prepared_data().items():
-            if value is None:
-                continue
-            attribute = self.__class__.__dict__.get(name)
-            if attribute and hasattr(attribute, 'jsonify'):
-                result[name] = attribute.jsonify(value)
-            elif name == '_id' and value:
-                result['id'] = str(value)
-            else:
-                result[name] = value
-        return result
+        return self._encode_json(self._get_prepared_data())
 
     @classmethod
-    def from_mongo(cls, payload):
+    def get_projection(cls, fields):
+        """
+        Returns ``Projection`` of the class fields loaded by a query with
+        ``fields`` projection (list of names or mongo projection dict), or
+        None if all fields are loaded.
+        """
+        if not fields:
+            return None
+        if isinstance(fields, Projection):
+            return fields
+        return _parse_projection(cls, fields)
+
+    @classmethod
+    def from_mongo(cls, payload, lazy=False, fields=None):
+        """
+        :param payload: document as returned by pymongo;
+        :param lazy: if True, field values are converted on first access
+            and untouched values are reused as is by ``to_mongo``;
+        :param fields: projection the payload was queried with, partial
+            document is returned then: defaults are not applied to the
+            fields not loaded, access to them raises ``FieldNotLoaded``
+            and only $set updates are allowed on save.
+        """
         if payload is None:
             return None
-        instance = cls()
-        for key, value in payload.items():
-            attribute = getattr(instance.__class__, key, None)
-            if attribute and hasattr(attribute, 'from_mongo'):
-                setattr(instance, key, attribute.from_mongo(value))
-            elif key == '_id' and value:
-                setattr(instance, key, value)
-        return instance
+        return cls._decode_mongo(payload, lazy, cls.get_projection(fields))
 
     @classmethod
     def from_json(cls, payload):
-        payload_ = {}
-        if payload:
-            for key, value in payload.items():
-                attribute = cls.__dict__.get(key)
-                if attribute and isinstance(attribute, GenericField):
-                    try:
-                        payload_[key] = attribute.from_json(value)
-                    except (ValueError, TypeError) as ex:
-                        raise ValidationError(repr(ex), key)
-                elif key in ('id', '_id') and value:
-                    payload_['_id'] = ObjectId(value)
-        instance = cls(**payload_)
-        return instance
+        return cls(**cls._decode_json(payload))
+
+    @classmethod
+    def from_json_many(cls, payloads, errors=None):
+        """
+        Yields documents converted from iterable of JSON payloads.
+        :param payloads: iterable of dicts;
+        :param errors: if list is passed, payloads failed to convert are
+            skipped and (index, ``ValidationError``) pairs are appended to
+            it, otherwise the first error is raised.
+        """
+        decode = cls._decode_json
+        for index, payload in enumerate(payloads):
+            try:
+                yield cls(**decode(payload))
+            except (ValidationError, ValueError, TypeError) as ex:
+                if errors is None:
+                    raise
+                if not isinstance(ex, ValidationError):
+                    ex = ValidationError(repr(ex))
+                errors.append((index, ex))
 
     def copy_in_place(self, instance):
-        self._data = copy.deepcopy(instance._data)
+        self._data = instance._copy_data(instance._data)
+        # whole document has to be checked and rewritten on next save
+        self._changed = None
+        self._projection = instance._projection
+        self._fingerprints = None
 
     def save(self):
         if self.objects:
@@ -183,25 +634,75 @@ class Document(with_metaclass(MongoDocumentMeta, object)):
         raise NotImplemented('objects attribute was not specified')
 
     def copy(self):
-        data = copy.deepcopy(self._data)
+        data = self._copy_data(self._data)
         data.pop('_id')
         return self.__class__(**data)
 
+    def _clone(self):
+        instance = object.__new__(self.__class__)
+        instance._data = self._copy_data(self._data)
+        instance._changed = None
+        instance._projection = self._projection
+        # fingerprints are replaced as a whole, so they could be shared
+        instance._fingerprints = self._fingerprints
+        return instance
+
+    # _id is read from data directly as it may be excluded by projection
     def __repr__(self):
-        return '{self.__class__.__name__}:{self.id}'.format(self=self)
+        return '{}:{}'.format(self.__class__.__name__, self._data.get('_id'))
 
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
             return False
 
-        if self.id is None:  # can't compare models without id's
+        _id = self._data.get('_id')
+        if _id is None:  # can't compare models without id's
             return False
-        return self.id == other.id
+        return _id == other._data.get('_id')
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        if self.id is None:
+        _id = self._data.get('_id')
+        if _id is None:
             raise TypeError('Documents without id are unhashable')
-        return hash(self.id)
+        return hash(_id)
+
+    # documents have __slots__, so pickle needs explicit state; values are
+    # put back into store of the class, compact documents stay compact
+    def __getstate__(self):
+        return {
+            'data': dict(self._data.items()),
+            'changed': self._changed,
+            'projection': self._projection,
+            'fingerprints': self._fingerprints,
+            'dict': getattr(self, '__dict__', None),
+        }
+
+    def __setstate__(self, state):
+        if 'data' not in state:
+            # instance __dict__ pickled by releases without __slots__,
+            # such documents are restored in the state of new ones
+            state = {
+                'data': state.get('_data', {}),
+                'changed': None,
+                'projection': None,
+                'dict': {
+                    key: value for key, value in state.items()
+                    if key != '_data'},
+            }
+        self._data = self._data_factory()
+        self._data.update(state['data'])
+        self._changed = self._restore_changes(state['changed'])
+        self._projection = state['projection']
+        self._fingerprints = state.get('fingerprints')
+        if state.get('dict'):
+            self.__dict__.update(state['dict'])
+
+    @staticmethod
+    def _restore_changes(names):
+        # field descriptors expect the shared empty set of clean documents
+        if isinstance(names, frozenset) and not names:
+            return NO_CHANGES
+        return names
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 import re
+import copy
 import sys
 import uuid
 import datetime
@@ -12,6 +13,18 @@ from dateutil import parser
 from ognom._registry import get_doc_class
 
 
+def _is_overridden(field, method_name, base):
+    return (
+        six.get_unbound_function(getattr(type(field), method_name)) is not
+        six.get_unbound_function(getattr(base, method_name)))
+
+
+def _copy_document(value):
+    if hasattr(value, '_clone'):
+        return value._clone()
+    return copy.deepcopy(value)
+
+
 class ValidationError(Exception):
     def __init__(self, message, field_name=None, *args, **kwargs):
         super(ValidationError, self).__init__(message)
@@ -19,7 +32,21 @@ class ValidationError(Exception):
         self.field_name = field_name
 
 
+class FieldNotLoaded(AttributeError):
+    """
+    Raised on access to a field which was excluded by projection of the
+    query the document was loaded with.
+    """
+
+
 class GenericField(object):
+    # whether values of the field could be changed in place,
+    # arbitrary values are treated as mutable
+    mutable = True
+    # name of the slot in stores of compact documents, set by metaclass
+    # for their own fields only, see MongoDocumentMeta
+    _slot = None
+
     def __init__(self, required=False, default=None, choices=None,
                  validators=None):
         self.required = required
@@ -31,14 +58,53 @@ class GenericField(object):
     def __get__(self, instance, owner):
         if not instance:
             return self
-        return instance._data.get(self.name)
+        if self._slot is not None:
+            try:
+                return getattr(instance._data, self._slot)
+            except AttributeError:
+                # value is not set or documents data is lazy
+                pass
+        value = instance._data.get(self.name)
+        if value is None:
+            projection = instance._projection
+            if projection is not None and \
+                    self.name not in projection.loaded and \
+                    self.name not in instance._data:
+                raise FieldNotLoaded(
+                    'Field {} was not loaded'.format(self.name))
+        return value
 
     def __set__(self, instance, value):
-        instance._data[self.name] = self.prepare_to_assign(value)
+        value = self.prepare_to_assign(value)
+        if self._slot is None:
+            instance._data[self.name] = value
+        else:
+            try:
+                setattr(instance._data, self._slot, value)
+            except AttributeError:
+                # documents data is lazy
+                instance._data[self.name] = value
+        # only changed fields are validated and saved, clean documents
+        # share immutable empty set, see NO_CHANGES
+        changed = instance._changed
+        if changed is not None:
+            if changed.__class__ is frozenset:
+                instance._changed = set((self.name,))
+            else:
+                changed.add(self.name)
 
     def prepare_to_assign(self, value):
         return value
 
+    def value_copier(self):
+        """
+        Returns callable which makes independent copy of assigned value
+        or None if value is immutable and could be shared between copies.
+        """
+        if self.mutable:
+            return copy.deepcopy
+        return None
+
     def validate(self, value):
         if value:
             for validator in self.validators:
@@ -49,12 +115,49 @@ class GenericField(object):
     def to_mongo(self, value):
         return value
 
+    def mongo_encoder(self):
+        """
+        Returns callable which converts assigned value to its mongo
+        representation or None if value could be stored as is.
+        Used by document metaclass to compile per-class serializer.
+        """
+        if _is_overridden(self, 'to_mongo', GenericField):
+            return self.to_mongo
+        return None
+
     def jsonify(self, value):
         return value
 
+    def json_encoder(self):
+        """
+        Returns callable which converts assigned value to JSON compatible
+        form or None if value could be used as is.
+        Used by document metaclass to compile per-class JSON serializer.
+        """
+        if _is_overridden(self, 'jsonify', GenericField):
+            return self.jsonify
+        return None
+
     def from_mongo(self, value):
         return value
 
+    def mongo_decoder(self):
+        """
+        Returns callable which converts value loaded from mongo to the form
+        it would have after assignment or None if value could be used as is.
+        Used by document metaclass to compile per-class deserializer.
+        """
+        from_mongo = _is_overridden(self, 'from_mongo', GenericField)
+        prepare = _is_overridden(self, 'prepare_to_assign', GenericField)
+        if from_mongo and prepare:
+            return lambda value: self.prepare_to_assign(
+                self.from_mongo(value))
+        if from_mongo:
+            return self.from_mongo
+        if prepare:
+            return self.prepare_to_assign
+        return None
+
     def from_json(self, value):
         """
         Most of the fields use BSON compatible types,
@@ -65,6 +168,8 @@ class GenericField(object):
 
 
 class StringField(GenericField):
+    mutable = False
+
     def validate(self, value):
         super(StringField, self).validate(value)
         if value and not isinstance(value, six.string_types):
@@ -73,9 +178,6 @@ class StringField(GenericField):
                 '{} of {} given!'.format(
                     self.name, value, type(value)), self.name)
 
-    def jsonify(self, value):
-        return value
-
 
 class URLField(StringField):
     _URL_REGEX = re.compile(
@@ -107,6 +209,8 @@ class HTTPField(URLField):
 
 class IntField(GenericField):
     """An 32-bit integer field."""
+    mutable = False
+
     def validate(self, value):
         super(IntField, self).validate(value)
         if value is not None and not isinstance(value, six.integer_types):
@@ -121,6 +225,8 @@ class IntField(GenericField):
 
 
 class FloatField(GenericField):
+    mutable = False
+
     def validate(self, value):
         super(FloatField, self).validate(value)
         if not isinstance(value, (float, decimal.Decimal, six.integer_types)):
@@ -133,6 +239,8 @@ class FloatField(GenericField):
 
 
 class DecimalField(GenericField):
+    mutable = False
+
     def validate(self, value):
         super(DecimalField, self).validate(value)
         try:
@@ -150,6 +258,8 @@ class DecimalField(GenericField):
 
 
 class UUIDField(GenericField):
+    mutable = False
+
     def to_mongo(self, value):
         if isinstance(value, six.string_types):
             return uuid.UUID(value)
@@ -167,6 +277,8 @@ class UUIDField(GenericField):
 
 
 class ObjectIdField(GenericField):
+    mutable = False
+
     def validate(self, value):
         super(ObjectIdField, self).validate(value)
         if not isinstance(value, ObjectId):
@@ -189,6 +301,8 @@ class ObjectIdField(GenericField):
 
 
 class DateTimeField(GenericField):
+    mutable = False
+
     def validate(self, value):
         super(DateTimeField, self).validate(value)
         if value and not isinstance(value, datetime.datetime):
@@ -222,6 +336,8 @@ class DateTimeField(GenericField):
 
 
 class BooleanField(GenericField):
+    mutable = False
+
     def validate(self, value):
         if not isinstance(value, bool):
             raise ValidationError(
@@ -239,6 +355,14 @@ class ListField(GenericField):
     def to_mongo(self, value):
         return [self.field_type.to_mongo(item) for item in value]
 
+    def mongo_encoder(self):
+        if _is_overridden(self, 'to_mongo', ListField):
+            return self.to_mongo
+        encode_item = self.field_type.mongo_encoder()
+        if encode_item is None:
+            return list
+        return lambda value: [encode_item(item) for item in value]
+
     def validate(self, value):
         super(ListField, self).validate(value)
         try:
@@ -254,9 +378,26 @@ class ListField(GenericField):
     def jsonify(self, value):
         return [self.field_type.jsonify(item) for item in value]
 
+    def json_encoder(self):
+        if _is_overridden(self, 'jsonify', ListField):
+            return self.jsonify
+        encode_item = self.field_type.json_encoder()
+        if encode_item is None:
+            return list
+        return lambda value: [encode_item(item) for item in value]
+
     def from_mongo(self, value):
         return [self.field_type.from_mongo(v) for v in value]
 
+    def mongo_decoder(self):
+        if (_is_overridden(self, 'from_mongo', ListField) or
+                _is_overridden(self, 'prepare_to_assign', ListField)):
+            return super(ListField, self).mongo_decoder()
+        decode_item = self.field_type.mongo_decoder()
+        if decode_item is None:
+            return list
+        return lambda value: [decode_item(v) for v in value]
+
     def from_json(self, value):
         return [self.field_type.from_json(v) for v in value]
 
@@ -267,6 +408,13 @@ class ListField(GenericField):
             ]
         return value
 
+    def value_copier(self):
+        copy_item = self.field_type.value_copier()
+        if copy_item is None:
+            return list
+        return lambda value: [
+            v if v is None else copy_item(v) for v in value]
+
 
 class DictField(GenericField):
     def __init__(self, field_type, required=False, default=None,
@@ -279,6 +427,15 @@ class DictField(GenericField):
         return {key: self.field_type.to_mongo(item)
                 for key, item in value.items()}
 
+    def mongo_encoder(self):
+        if _is_overridden(self, 'to_mongo', DictField):
+            return self.to_mongo
+        encode_item = self.field_type.mongo_encoder()
+        if encode_item is None:
+            return dict
+        return lambda value: {
+            key: encode_item(item) for key, item in value.items()}
+
     def validate(self, value):
         super(DictField, self).validate(value)
         if value is None:
@@ -295,12 +452,30 @@ class DictField(GenericField):
         return {key: self.field_type.jsonify(item)
                 for key, item in value.items()}
 
+    def json_encoder(self):
+        if _is_overridden(self, 'jsonify', DictField):
+            return self.jsonify
+        encode_item = self.field_type.json_encoder()
+        if encode_item is None:
+            return dict
+        return lambda value: {
+            key: encode_item(item) for key, item in value.items()}
+
     def from_mongo(self, value):
         return {
             k: self.field_type.from_mongo(v)
             for k, v in value.items()
         }
 
+    def mongo_decoder(self):
+        if (_is_overridden(self, 'from_mongo', DictField) or
+                _is_overridden(self, 'prepare_to_assign', DictField)):
+            return super(DictField, self).mongo_decoder()
+        decode_item = self.field_type.mongo_decoder()
+        if decode_item is None:
+            return dict
+        return lambda value: {k: decode_item(v) for k, v in value.items()}
+
     def from_json(self, value):
         return {
             k: self.field_type.from_json(v)
@@ -313,6 +488,13 @@ class DictField(GenericField):
                 value[key] = self.field_type.prepare_to_assign(item)
         return value
 
+    def value_copier(self):
+        copy_item = self.field_type.value_copier()
+        if copy_item is None:
+            return dict
+        return lambda value: {
+            k: v if v is None else copy_item(v) for k, v in value.items()}
+
 
 class DocumentField(GenericField):
     def __init__(self, model_class, required=False, default=None,
@@ -354,7 +536,17 @@ class DocumentField(GenericField):
     def from_mongo(self, payload):
         if payload is None:
             return None
-        return self.model_class(**payload)
+        # embedded documents are decoded like loaded ones, so their
+        # changes are tracked since then
+        return self.model_class._decode_mongo(payload, fingerprints=False)
+
+    def mongo_decoder(self):
+        if (_is_overridden(self, 'from_mongo', DocumentField) or
+                _is_overridden(self, 'prepare_to_assign', DocumentField)):
+            return super(DocumentField, self).mongo_decoder()
+        # from_mongo already returns an instance of model class,
+        # there is nothing left for prepare_to_assign
+        return self.from_mongo
 
     def from_json(self, value):
         return self.model_class.from_json(value)
@@ -364,6 +556,9 @@ class DocumentField(GenericField):
             value = self.model_class(**value)
         return value
 
+    def value_copier(self):
+        return _copy_document
+
     @property
     def model_class(self):
         if self._model_class is None:
@@ -415,9 +610,16 @@ class GenericDocumentField(GenericField):
     def from_mongo(self, payload):
         if payload:
             value_class = self._get_class(payload)
-            return value_class(**payload)
+            return value_class._decode_mongo(payload, fingerprints=False)
         return None
 
+    def mongo_decoder(self):
+        if (_is_overridden(self, 'from_mongo', GenericDocumentField) or
+                _is_overridden(
+                    self, 'prepare_to_assign', GenericDocumentField)):
+            return super(GenericDocumentField, self).mongo_decoder()
+        return self.from_mongo
+
     def from_json(self, value):
         value_class = self._get_class(value)
         return value_class.from_json(value)
@@ -429,6 +631,9 @@ class GenericDocumentField(GenericField):
             value = value_class(**value)
         return value
 
+    def value_copier(self):
+        return _copy_document
+
     def _get_class(self, value):
         attribute_value = value.get(self.attribute)
         value_class = self.attr_to_class.get(attribute_value)
@@ -438,5 +643,87 @@ class GenericDocumentField(GenericField):
         return value_class
 
 
+class ReferenceField(GenericField):
+    """
+    Reference to a document of ``model_class`` stored in its own
+    collection, only ``_id`` is stored. Referenced document is fetched
+    with ``model_class.objects`` on first access and kept in place of the
+    id, ``CursorWrapper.select_related`` fetches references of many
+    documents at once.
+    """
+    mutable = False
+
+    def __init__(self, model_class, required=False, default=None,
+                 validators=None):
+        super(ReferenceField, self).__init__(
+            required, default, validators=validators)
+        if isinstance(model_class, six.string_types):
+            self._model_class_name = model_class
+            self._model_class = None
+        else:
+            self._model_class = model_class
+
+    def __get__(self, instance, owner):
+        value = super(ReferenceField, self).__get__(instance, owner)
+        if instance and isinstance(value, ObjectId):
+            document = self.model_class.objects.get(value)
+            if document is not None:
+                self.resolve(instance, document)
+            return document
+        return value
+
+    def get_id(self, instance):
+        """
+        Returns id of referenced document without fetching it.
+        """
+        value = instance._data.get(self.name)
+        return getattr(value, '_id', value)
+
+    def is_resolved(self, instance):
+        return isinstance(instance._data.get(self.name), self.model_class)
+
+    def resolve(self, instance, document):
+        # referenced document replaces id without marking field changed
+        instance._data[self.name] = document
+
+    def validate(self, value):
+        super(ReferenceField, self).validate(value)
+        if isinstance(value, self.model_class):
+            if value._id is None:
+                raise ValidationError(
+                    '[{}] Referenced document {!r} is not saved'.format(
+                        self.name, value), self.name)
+        elif not isinstance(value, ObjectId):
+            raise ValidationError(
+                '[{}] Invalid reference {}'.format(self.name, value),
+                self.name)
+
+    def to_mongo(self, value):
+        return getattr(value, '_id', value)
+
+    def jsonify(self, value):
+        return str(self.to_mongo(value))
+
+    def mongo_decoder(self):
+        # ids are loaded from mongo as ObjectId already
+        return None
+
+    def prepare_to_assign(self, value):
+        if value is None or isinstance(value, (ObjectId, self.model_class)):
+            return value
+        try:
+            return ObjectId(value)
+        except Exception as ex:
+            raise ValidationError(
+                '[{}] Invalid reference {}. Error: {}'.format(
+                    self.name, value, repr(ex)), self.name)
+
+    @property
+    def model_class(self):
+        if self._model_class is None:
+            self._model_class = get_doc_class(self._model_class_name)
+        return self._model_class
+
+
 class IdField(ObjectIdField):
     name = '_id'
@@ -0,0 +1,1688 @@
+"""
+In-memory storage backend. Implements the part of pymongo collection API
+``Collection`` relies on, so documents could be stored without mongod,
+for example in tests or as a process local cache::
+
+    ConnectionManager.connect({'main': {'name': 'db', 'backend': 'memory'}})
+
+Supported query operators are $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin,
+$exists, $not, $all, $size, $elemMatch, $regex, $mod, $and, $or and $nor;
+update operators are $set, $unset, $inc, $mul, $min, $max, $push,
+$addToSet, $pull, $pullAll, $pop, $rename, $setOnInsert and $currentDate;
+aggregation stages are $match, $sort, $skip, $limit, $project, $group,
+$unwind, $lookup and $count. Anything else raises ``OperationFailure``.
+
+Indexes declared in ``Collection.indexes`` are created by
+``synchronize_indexes`` as usual. Each index keeps a hash table and
+a sorted list of values of its first field, so equality, $in and range
+conditions on it are answered without scanning the whole collection.
+Unique indexes are enforced and expired documents of TTL indexes are
+removed before each operation.
+
+Documents are stored in the form they would have after a round trip to
+mongo and returned as copies.
+"""
+from __future__ import unicode_literals
+import operator
+import re
+import threading
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from itertools import count, product
+
+import six
+from bson import BSON, ObjectId
+from bson.binary import Binary
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.regex import Regex
+from bson.timestamp import Timestamp
+from pymongo.errors import (
+    BulkWriteError, DuplicateKeyError, InvalidOperation, OperationFailure)
+
+try:
+    from bson.decimal128 import Decimal128
+except ImportError:  # pymongo < 3.4
+    Decimal128 = None
+
+
+_RE_TYPE = type(re.compile(''))
+
+_NUMBER_TYPES = six.integer_types + (float,)
+
+_REGEX_FLAGS = {
+    'i': re.IGNORECASE, 'm': re.MULTILINE, 'x': re.VERBOSE, 's': re.DOTALL}
+
+_DUPLICATE_KEY = 11000
+
+# bound of not limited side of a range
+_UNBOUNDED = object()
+
+
+def _sort_key(value):
+    # key ordering values the way mongo does: by type first, then by value
+    # of the same type, equal keys mean equal values
+    if value is None:
+        return 2, 0
+    if isinstance(value, bool):
+        return 9, value
+    if isinstance(value, _NUMBER_TYPES):
+        return 3, value
+    if isinstance(value, six.string_types):
+        return 4, value
+    if isinstance(value, dict):
+        return 5, tuple((key, _sort_key(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 6, tuple(_sort_key(item) for item in value)
+    if isinstance(value, uuid.UUID):
+        return 7, value.bytes
+    if isinstance(value, (Binary, bytes)):
+        return 7, bytes(value)
+    if isinstance(value, ObjectId):
+        return 8, value.binary
+    if isinstance(value, datetime):
+        return 10, value
+    if isinstance(value, Timestamp):
+        return 11, (value.time, value.inc)
+    if isinstance(value, (_RE_TYPE, Regex)):
+        return 12, value.pattern
+    if isinstance(value, MinKey):
+        return 1, 0
+    if isinstance(value, MaxKey):
+        return 14, 0
+    if Decimal128 is not None and isinstance(value, Decimal128):
+        return 3, value.to_decimal()
+    return 13, repr(value)
+
+
+def _equal(value, other):
+    if value.__class__ is other.__class__ and \
+            not isinstance(value, (dict, list)):
+        return value == other
+    return _sort_key(value) == _sort_key(other)
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _normalize(doc, check_keys=False):
+    # document as it would be stored by mongo, raises InvalidDocument
+    return BSON.encode(doc, check_keys).decode()
+
+
+def _is_operators(value):
+    return isinstance(value, dict) and bool(value) and all(
+        key.startswith('$') for key in value)
+
+
+def _is_regex(value):
+    return isinstance(value, (_RE_TYPE, Regex))
+
+
+def _compile_regex(pattern, options=''):
+    if isinstance(pattern, Regex):
+        return pattern.try_compile()
+    if isinstance(pattern, _RE_TYPE):
+        return pattern
+    flags = 0
+    for option in options or '':
+        flags |= _REGEX_FLAGS.get(option, 0)
+    return re.compile(pattern, flags)
+
+
+def _resolve(doc, path):
+    # values found by dotted path, arrays on the way are traversed
+    values = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    found.append(value[int(part)])
+                found.extend(
+                    item[part] for item in value
+                    if isinstance(item, dict) and part in item)
+        values = found
+    return values
+
+
+def _elements(values):
+    # values with arrays replaced by their items, missing value is null
+    if not values:
+        return [None]
+    result = []
+    for value in values:
+        if isinstance(value, list):
+            result.extend(value)
+        else:
+            result.append(value)
+    return result
+
+
+# query matching
+
+def _match(doc, spec):
+    for key, condition in spec.items():
+        if key.startswith('$'):
+            if key == '$and':
+                matched = all(_match(doc, query) for query in condition)
+            elif key == '$or':
+                matched = any(_match(doc, query) for query in condition)
+            elif key == '$nor':
+                matched = not any(_match(doc, query) for query in condition)
+            elif key == '$comment':
+                continue
+            else:
+                raise OperationFailure('Unsupported operator {}'.format(key))
+            if not matched:
+                return False
+        elif not _match_field(_resolve(doc, key), condition):
+            return False
+    return True
+
+
+def _match_field(values, condition):
+    if _is_operators(condition):
+        for name, argument in condition.items():
+            if name == '$options':
+                continue
+            if name == '$regex':
+                argument = _compile_regex(
+                    argument, condition.get('$options'))
+            try:
+                matcher = _QUERY_OPERATORS[name]
+            except KeyError:
+                raise OperationFailure(
+                    'Unsupported operator {}'.format(name))
+            if not matcher(values, argument):
+                return False
+        return True
+    if _is_regex(condition):
+        return _match_regex(values, condition)
+    return _match_equal(values, condition)
+
+
+def _match_equal(values, target):
+    if not values:
+        return target is None
+    for value in values:
+        if _equal(value, target):
+            return True
+        if isinstance(value, list) and any(
+                _equal(item, target) for item in value):
+            return True
+    return False
+
+
+def _match_regex(values, pattern):
+    pattern = _compile_regex(pattern)
+    return any(
+        isinstance(value, six.string_types) and pattern.search(value)
+        for value in _elements(values))
+
+
+def _match_in(values, targets):
+    return any(
+        _match_regex(values, target) if _is_regex(target)
+        else _match_equal(values, target)
+        for target in targets)
+
+
+def _comparison(compare):
+    def match(values, bound):
+        key = _sort_key(bound)
+        for value in _elements(values):
+            value_key = _sort_key(value)
+            # only values of the same type are compared
+            if value_key[0] == key[0] and compare(value_key, key):
+                return True
+        return False
+    return match
+
+
+def _match_elem(values, query):
+    for value in values:
+        if not isinstance(value, list):
+            continue
+        for item in value:
+            if _is_operators(query):
+                if _match_field([item], query):
+                    return True
+            elif isinstance(item, dict) and _match(item, query):
+                return True
+    return False
+
+
+def _match_mod(values, argument):
+    divisor, remainder = argument
+    return any(
+        isinstance(value, _NUMBER_TYPES) and
+        not isinstance(value, bool) and
+        int(value) % divisor == remainder
+        for value in _elements(values))
+
+
+_QUERY_OPERATORS = {
+    '$eq': _match_equal,
+    '$ne': lambda values, target: not _match_equal(values, target),
+    '$gt': _comparison(operator.gt),
+    '$gte': _comparison(operator.ge),
+    '$lt': _comparison(operator.lt),
+    '$lte': _comparison(operator.le),
+    '$in': _match_in,
+    '$nin': lambda values, targets: not _match_in(values, targets),
+    '$exists': lambda values, exists: bool(values) == bool(exists),
+    '$not': lambda values, condition: not _match_field(values, condition),
+    '$all': lambda values, targets: bool(targets) and all(
+        _match_field(values, target) for target in targets),
+    '$size': lambda values, size: any(
+        isinstance(value, list) and len(value) == size for value in values),
+    '$elemMatch': _match_elem,
+    '$regex': _match_regex,
+    '$mod': _match_mod,
+}
+
+
+def _sort(docs, sort, get=lambda item: item):
+    for path, direction in reversed(list(sort)):
+        reverse = direction < 0
+
+        def key(item):
+            keys = [_sort_key(value) for value in _elements(
+                _resolve(get(item), path))]
+            if not keys:
+                # empty array, sorted before null as in mongo
+                return 0, ()
+            # arrays are sorted by their least or greatest item
+            return max(keys) if reverse else min(keys)
+        docs = sorted(docs, key=key, reverse=reverse)
+    return docs
+
+
+# projection
+
+def _path_tree(paths):
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is True:
+                break
+            node = child
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _include(value, tree):
+    if isinstance(value, list):
+        return [
+            _include(item, tree) for item in value
+            if isinstance(item, (dict, list))]
+    result = {}
+    for key, item in value.items():
+        node = tree.get(key)
+        if node is True:
+            result[key] = _copy(item)
+        elif node is not None and isinstance(item, (dict, list)):
+            result[key] = _include(item, node)
+    return result
+
+
+def _exclude(value, tree):
+    if isinstance(value, list):
+        return [
+            _exclude(item, tree) if isinstance(item, (dict, list))
+            else _copy(item)
+            for item in value]
+    result = {}
+    for key, item in value.items():
+        node = tree.get(key)
+        if node is None:
+            result[key] = _copy(item)
+        elif node is not True:
+            result[key] = (
+                _exclude(item, node) if isinstance(item, (dict, list))
+                else _copy(item))
+    return result
+
+
+def _slice(doc, path, argument):
+    parts = path.split('.')
+    node = doc
+    for part in parts[:-1]:
+        node = node.get(part) if isinstance(node, dict) else None
+    if not isinstance(node, dict) or \
+            not isinstance(node.get(parts[-1]), list):
+        return
+    items = node[parts[-1]]
+    if isinstance(argument, list):
+        skip, limit = argument
+        if skip < 0:
+            skip = max(len(items) + skip, 0)
+        node[parts[-1]] = items[skip:skip + limit]
+    elif argument < 0:
+        node[parts[-1]] = items[argument:]
+    else:
+        node[parts[-1]] = items[:argument]
+
+
+def _project(doc, fields):
+    if not fields:
+        return _copy(doc)
+    if not isinstance(fields, dict):
+        fields = dict.fromkeys(fields, 1)
+
+    slices = {}
+    included = []
+    excluded = []
+    for path, value in fields.items():
+        if isinstance(value, dict):
+            if list(value) != ['$slice']:
+                raise OperationFailure(
+                    'Unsupported projection {!r}'.format(value))
+            slices[path] = value['$slice']
+        elif path != '_id':
+            (included if value else excluded).append(path)
+    if included and excluded:
+        raise OperationFailure(
+            'Projection cannot have a mix of inclusion and exclusion')
+
+    include_id = fields.get('_id', 1)
+    if included or (not excluded and not slices and include_id):
+        tree = _path_tree(included + list(slices))
+        if include_id:
+            tree['_id'] = True
+        result = _include(doc, tree)
+    else:
+        tree = _path_tree(excluded)
+        if not include_id:
+            tree['_id'] = True
+        result = _exclude(doc, tree)
+    for path, argument in slices.items():
+        _slice(result, path, argument)
+    return result
+
+
+# updates
+
+def _parent(doc, path, create):
+    # container holding the last part of dotted path and key in it
+    parts = path.split('.')
+    node = doc
+    for position, part in enumerate(parts, 1):
+        key = part
+        if isinstance(node, list):
+            if not part.isdigit():
+                raise OperationFailure(
+                    'Cannot use the part ({}) of ({}) to traverse '
+                    'the array'.format(part, path))
+            key = int(part)
+        elif not isinstance(node, dict):
+            raise OperationFailure(
+                'Cannot traverse element of ({})'.format(path))
+        if position == len(parts):
+            return node, key
+        child = _get(node, key)
+        if child is None:
+            if not create:
+                return None, None
+            child = {}
+            _set(node, key, child)
+        node = child
+
+
+def _get(container, key, default=None):
+    if isinstance(container, list):
+        return container[key] if key < len(container) else default
+    return container.get(key, default)
+
+
+def _set(container, key, value):
+    if isinstance(container, list):
+        container.extend([None] * (key + 1 - len(container)))
+    container[key] = value
+
+
+def _delete(container, key):
+    if isinstance(container, list):
+        # array keeps its length
+        if key < len(container):
+            container[key] = None
+    else:
+        container.pop(key, None)
+
+
+def _update_number(update):
+    def apply(doc, path, argument):
+        if not isinstance(argument, _NUMBER_TYPES):
+            raise OperationFailure(
+                'Cannot apply to non-numeric argument {!r}'.format(argument))
+        container, key = _parent(doc, path, True)
+        value = _get(container, key, 0)
+        if not isinstance(value, _NUMBER_TYPES):
+            raise OperationFailure(
+                'Cannot apply to non-numeric field {}'.format(path))
+        _set(container, key, update(value, argument))
+    return apply
+
+
+def _update_bound(compare):
+    def apply(doc, path, argument):
+        container, key = _parent(doc, path, True)
+        value = _get(container, key, _UNBOUNDED)
+        if value is _UNBOUNDED or compare(
+                _sort_key(argument), _sort_key(value)):
+            _set(container, key, argument)
+    return apply
+
+
+def _array(doc, path):
+    container, key = _parent(doc, path, True)
+    value = _get(container, key)
+    if value is None:
+        value = []
+        _set(container, key, value)
+    elif not isinstance(value, list):
+        raise OperationFailure('Field {} is not an array'.format(path))
+    return value
+
+
+def _each(argument):
+    if isinstance(argument, dict) and '$each' in argument:
+        return argument['$each']
+    return [argument]
+
+
+def _update_set(doc, path, argument):
+    container, key = _parent(doc, path, True)
+    _set(container, key, _copy(argument))
+
+
+def _update_unset(doc, path, argument):
+    container, key = _parent(doc, path, False)
+    if container is not None:
+        _delete(container, key)
+
+
+def _update_push(doc, path, argument):
+    value = _array(doc, path)
+    value.extend(_copy(item) for item in _each(argument))
+    if isinstance(argument, dict) and '$slice' in argument:
+        sliced = {'value': value}
+        _slice(sliced, 'value', argument['$slice'])
+        value[:] = sliced['value']
+
+
+def _update_add_to_set(doc, path, argument):
+    value = _array(doc, path)
+    for item in _each(argument):
+        if not any(_equal(existing, item) for existing in value):
+            value.append(_copy(item))
+
+
+def _update_pull(doc, path, argument):
+    container, key = _parent(doc, path, False)
+    value = _get(container, key) if container is not None else None
+    if not isinstance(value, list):
+        return
+
+    def matches(item):
+        if _is_operators(argument):
+            return _match_field([item], argument)
+        if isinstance(argument, dict) and not isinstance(item, dict):
+            return False
+        if isinstance(argument, dict):
+            return _match(item, argument)
+        if _is_regex(argument):
+            return _match_regex([item], argument)
+        return _equal(item, argument)
+    value[:] = [item for item in value if not matches(item)]
+
+
+def _update_pull_all(doc, path, argument):
+    container, key = _parent(doc, path, False)
+    value = _get(container, key) if container is not None else None
+    if isinstance(value, list):
+        value[:] = [
+            item for item in value
+            if not any(_equal(item, other) for other in argument)]
+
+
+def _update_pop(doc, path, argument):
+    container, key = _parent(doc, path, False)
+    value = _get(container, key) if container is not None else None
+    if isinstance(value, list) and value:
+        value.pop(0 if argument < 0 else -1)
+
+
+def _update_rename(doc, path, argument):
+    container, key = _parent(doc, path, False)
+    if container is None or not isinstance(container, dict) or \
+            key not in container:
+        return
+    value = container.pop(key)
+    target, target_key = _parent(doc, argument, True)
+    _set(target, target_key, value)
+
+
+def _update_current_date(doc, path, argument):
+    container, key = _parent(doc, path, True)
+    if isinstance(argument, dict) and \
+            argument.get('$type') == 'timestamp':
+        _set(container, key, Timestamp(datetime.utcnow(), 0))
+    else:
+        _set(container, key, datetime.utcnow())
+
+
+_UPDATE_OPERATORS = {
+    '$set': _update_set,
+    '$unset': _update_unset,
+    '$inc': _update_number(operator.add),
+    '$mul': _update_number(operator.mul),
+    '$min': _update_bound(operator.lt),
+    '$max': _update_bound(operator.gt),
+    '$push': _update_push,
+    '$addToSet': _update_add_to_set,
+    '$pull': _update_pull,
+    '$pullAll': _update_pull_all,
+    '$pop': _update_pop,
+    '$rename': _update_rename,
+    '$currentDate': _update_current_date,
+}
+
+
+def _is_update(document):
+    operators = [key.startswith('$') for key in document]
+    if any(operators) and not all(operators):
+        raise OperationFailure(
+            'Update document can\'t mix operators and fields')
+    return bool(operators) and all(operators)
+
+
+def _updated(doc, document, inserting=False):
+    """
+    Returns new version of stored ``doc`` changed by ``document``, which
+    is either replacement or an update with operators.
+    """
+    if not _is_update(document):
+        _id = document.get('_id', doc.get('_id'))
+        result = OrderedDict([('_id', _id)])
+        result.update(
+            (key, _copy(value)) for key, value in document.items()
+            if key != '_id')
+    else:
+        result = _copy(doc)
+        for name, arguments in document.items():
+            if name == '$setOnInsert':
+                if not inserting:
+                    continue
+                apply = _update_set
+            else:
+                try:
+                    apply = _UPDATE_OPERATORS[name]
+                except KeyError:
+                    raise OperationFailure(
+                        'Unsupported operator {}'.format(name))
+            for path, argument in arguments.items():
+                if '$' in path.split('.'):
+                    raise OperationFailure(
+                        'Positional operator is not supported: {}'.format(
+                            path))
+                apply(result, path, argument)
+    if '_id' in doc and not _equal(result.get('_id'), doc['_id']):
+        raise OperationFailure(
+            'The _id field cannot be changed from {!r} to {!r}'.format(
+                doc['_id'], result.get('_id')))
+    return _normalize(result)
+
+
+def _seed(spec, doc):
+    # fields of document inserted by upsert taken from equality conditions
+    for key, condition in spec.items():
+        if key == '$and':
+            for query in condition:
+                _seed(query, doc)
+        elif key.startswith('$') or _is_regex(condition):
+            continue
+        elif _is_operators(condition):
+            if '$eq' in condition:
+                _update_set(doc, key, condition['$eq'])
+        else:
+            _update_set(doc, key, condition)
+    return doc
+
+
+def _upserted(spec, document):
+    seed = _seed(spec, {})
+    if _is_update(document):
+        doc = OrderedDict([('_id', seed.pop('_id', None) or ObjectId())])
+        doc.update(seed)
+        return _updated(_normalize(doc), document, inserting=True)
+    doc = OrderedDict([('_id', document.get('_id', seed.get('_id')))])
+    if doc['_id'] is None:
+        doc['_id'] = ObjectId()
+    doc.update(
+        (key, value) for key, value in document.items() if key != '_id')
+    return _normalize(doc, True)
+
+
+# aggregation
+
+def _evaluate(expression, doc):
+    if isinstance(expression, six.string_types) and \
+            expression.startswith('$'):
+        values = _resolve(doc, expression[1:])
+        if not values:
+            return None
+        return values[0] if len(values) == 1 else values
+    if isinstance(expression, dict):
+        if _is_operators(expression):
+            raise OperationFailure(
+                'Unsupported expression {!r}'.format(expression))
+        return {
+            key: _evaluate(value, doc) for key, value in expression.items()}
+    return expression
+
+
+def _accumulate(name, expression, docs):
+    values = [_evaluate(expression, doc) for doc in docs]
+    if name == '$sum':
+        return sum(
+            value for value in values
+            if isinstance(value, _NUMBER_TYPES) and
+            not isinstance(value, bool))
+    if name == '$avg':
+        numbers = [
+            value for value in values
+            if isinstance(value, _NUMBER_TYPES) and
+            not isinstance(value, bool)]
+        return float(sum(numbers)) / len(numbers) if numbers else None
+    if name in ('$min', '$max'):
+        values = [value for value in values if value is not None]
+        if not values:
+            return None
+        return (min if name == '$min' else max)(values, key=_sort_key)
+    if name == '$first':
+        return values[0] if values else None
+    if name == '$last':
+        return values[-1] if values else None
+    if name == '$push':
+        return values
+    if name == '$addToSet':
+        result = []
+        for value in values:
+            if not any(_equal(value, other) for other in result):
+                result.append(value)
+        return result
+    raise OperationFailure('Unsupported accumulator {}'.format(name))
+
+
+def _group(docs, spec):
+    groups = OrderedDict()
+    for doc in docs:
+        _id = _evaluate(spec['_id'], doc)
+        groups.setdefault(_sort_key(_id), (_id, []))[1].append(doc)
+    result = []
+    for _id, group in groups.values():
+        item = {'_id': _id}
+        for name, accumulator in spec.items():
+            if name == '_id':
+                continue
+            (operator_name, expression), = accumulator.items()
+            item[name] = _accumulate(operator_name, expression, group)
+        result.append(item)
+    return result
+
+
+def _project_stage(docs, spec):
+    computed = {
+        key: value for key, value in spec.items()
+        if isinstance(value, (six.string_types, dict))}
+    fields = {
+        key: value for key, value in spec.items() if key not in computed}
+    result = []
+    for doc in docs:
+        if fields or not computed:
+            item = _project(doc, fields)
+        else:
+            item = _project(doc, {'_id': fields.get('_id', 1)})
+        for key, expression in computed.items():
+            _update_set(item, key, _evaluate(expression, doc))
+        result.append(item)
+    return result
+
+
+def _unwind(docs, spec):
+    if isinstance(spec, dict):
+        path = spec['path']
+        preserve = spec.get('preserveNullAndEmptyArrays', False)
+    else:
+        path, preserve = spec, False
+    path = path[1:]
+    result = []
+    for doc in docs:
+        container, key = _parent(doc, path, False)
+        value = _get(container, key) if container is not None else None
+        if not isinstance(value, list):
+            if value is not None or preserve:
+                result.append(doc)
+            continue
+        if not value and preserve:
+            item = _copy(doc)
+            _update_unset(item, path, '')
+            result.append(item)
+        for element in value:
+            item = _copy(doc)
+            _update_set(item, path, element)
+            result.append(item)
+    return result
+
+
+class _Index(object):
+    """
+    Index of records of ``MemoryCollection``. Values of the first field
+    are kept in a hash table and in a sorted list, so equality and range
+    conditions on it are answered without scan. Arrays are indexed by
+    their items, missing values as null.
+    """
+    def __init__(self, name, key, unique=False, sparse=False, **options):
+        self.name = name
+        self.key = key
+        self.field = key[0][0]
+        self.unique = bool(unique)
+        self.sparse = bool(sparse)
+        self.options = options
+        self._hash = {}  # sort key of first field value -> set of record ids
+        self._sorted_keys = []
+        self._sorted_ids = []
+        self._unique = {}  # tuple of sort keys of all fields -> record id
+        # number of records with several keys, arrays of different items
+        self._multikey = 0
+
+    def information(self):
+        result = {'key': list(self.key), 'v': 1}
+        if self.unique:
+            result['unique'] = True
+        if self.sparse:
+            result['sparse'] = True
+        result.update(self.options)
+        return result
+
+    def _keys(self, doc, path):
+        values = _resolve(doc, path)
+        if not values and self.sparse:
+            return set()
+        return set(_sort_key(value) for value in _elements(values))
+
+    def _unique_keys(self, doc):
+        if not self.unique:
+            return ()
+        keys = [self._keys(doc, path) for path, _ in self.key]
+        return set(product(*keys))
+
+    def check(self, doc, record_id=None):
+        """
+        Raises ``DuplicateKeyError`` if ``doc`` stored as ``record_id``
+        (None for new records) would violate uniqueness.
+        """
+        for key in self._unique_keys(doc):
+            other = self._unique.get(key)
+            if other is not None and other != record_id:
+                raise DuplicateKeyError(
+                    'E11000 duplicate key error index: {} dup key: '
+                    '{!r}'.format(self.name, key), _DUPLICATE_KEY)
+
+    def add(self, doc, record_id):
+        keys = self._keys(doc, self.field)
+        if len(keys) > 1:
+            self._multikey += 1
+        for key in keys:
+            self._hash.setdefault(key, set()).add(record_id)
+            position = bisect_right(self._sorted_keys, key)
+            self._sorted_keys.insert(position, key)
+            self._sorted_ids.insert(position, record_id)
+        for key in self._unique_keys(doc):
+            self._unique[key] = record_id
+
+    def remove(self, doc, record_id):
+        keys = self._keys(doc, self.field)
+        if len(keys) > 1:
+            self._multikey -= 1
+        for key in keys:
+            ids = self._hash.get(key)
+            if ids is not None:
+                ids.discard(record_id)
+                if not ids:
+                    del self._hash[key]
+            start = bisect_left(self._sorted_keys, key)
+            end = bisect_right(self._sorted_keys, key)
+            for position in range(start, end):
+                if self._sorted_ids[position] == record_id:
+                    del self._sorted_keys[position]
+                    del self._sorted_ids[position]
+                    break
+        for key in self._unique_keys(doc):
+            if self._unique.get(key) == record_id:
+                del self._unique[key]
+
+    def rebuild(self, records):
+        entries = []
+        unique = {}
+        multikey = 0
+        for record_id, doc in records.items():
+            keys = self._keys(doc, self.field)
+            if len(keys) > 1:
+                multikey += 1
+            for key in keys:
+                entries.append((key, record_id))
+            for key in self._unique_keys(doc):
+                if key in unique:
+                    raise DuplicateKeyError(
+                        'E11000 duplicate key error index: {} dup key: '
+                        '{!r}'.format(self.name, key), _DUPLICATE_KEY)
+                unique[key] = record_id
+        entries.sort(key=lambda entry: entry[0])
+        self._hash = {}
+        for key, record_id in entries:
+            self._hash.setdefault(key, set()).add(record_id)
+        self._sorted_keys = [key for key, _ in entries]
+        self._sorted_ids = [record_id for _, record_id in entries]
+        self._unique = unique
+        self._multikey = multikey
+
+    def _equal(self, value):
+        if isinstance(value, (dict, list)) or _is_regex(value) or (
+                value is None and self.sparse):
+            return None
+        return self._hash.get(_sort_key(value), frozenset())
+
+    def range(self, lower=_UNBOUNDED, upper=_UNBOUNDED,
+              include_lower=True, include_upper=True):
+        """
+        Returns ids of records which values of the first field of the same
+        type as bounds are between them.
+        """
+        keys = self._sorted_keys
+        lower_key = upper_key = None
+        if lower is not _UNBOUNDED:
+            lower_key = _sort_key(lower)
+        if upper is not _UNBOUNDED:
+            upper_key = _sort_key(upper)
+        if lower_key and upper_key and lower_key[0] != upper_key[0]:
+            return set()
+        rank = (lower_key or upper_key)[0]
+        if lower_key is None:
+            start = bisect_left(keys, (rank,))
+        elif include_lower:
+            start = bisect_left(keys, lower_key)
+        else:
+            start = bisect_right(keys, lower_key)
+        if upper_key is None:
+            end = bisect_left(keys, (rank + 1,))
+        elif include_upper:
+            end = bisect_right(keys, upper_key)
+        else:
+            end = bisect_left(keys, upper_key)
+        return set(self._sorted_ids[start:end])
+
+    def lookup(self, condition):
+        """
+        Returns ids of records which may match ``condition`` on the first
+        field, or None if the index can't narrow it down.
+        """
+        if not _is_operators(condition):
+            condition = {'$eq': condition}
+        result = None
+        bounds = {}
+        for name, argument in condition.items():
+            if name == '$eq':
+                ids = self._equal(argument)
+            elif name == '$in':
+                found = [self._equal(value) for value in argument]
+                if any(ids is None for ids in found):
+                    continue
+                ids = set().union(*found)
+            elif name in ('$gt', '$gte', '$lt', '$lte'):
+                if isinstance(argument, (dict, list)) or (
+                        argument is None and self.sparse):
+                    continue
+                bounds[name] = argument
+                continue
+            else:
+                continue
+            if ids is not None:
+                result = ids if result is None else result & ids
+        if bounds and self._multikey:
+            # each bound could be met by a different item of an array,
+            # so bounds are looked up one by one
+            for name, argument in bounds.items():
+                if name in ('$gt', '$gte'):
+                    ids = self.range(
+                        lower=argument, include_lower=name == '$gte')
+                else:
+                    ids = self.range(
+                        upper=argument, include_upper=name == '$lte')
+                result = ids if result is None else result & ids
+        elif bounds:
+            lower = bounds.get('$gt', bounds.get('$gte', _UNBOUNDED))
+            upper = bounds.get('$lt', bounds.get('$lte', _UNBOUNDED))
+            ids = self.range(
+                lower, upper, '$gt' not in bounds, '$lt' not in bounds)
+            result = ids if result is None else result & ids
+        return result
+
+
+def _index_key(key_or_list, direction=None):
+    if isinstance(key_or_list, six.string_types):
+        return [(key_or_list, direction or 1)]
+    return [tuple(item) for item in key_or_list]
+
+
+class MemoryCursor(object):
+    """
+    Result of ``MemoryCollection.find``, query is executed on first
+    iteration and documents are copied out of the collection then.
+    """
+    def __init__(self, collection, spec=None, fields=None, skip=0,
+                 limit=0, sort=None, **kwargs):
+        self.collection = collection
+        self._spec = spec or {}
+        self._fields = fields
+        self._skip = skip or 0
+        self._limit = limit or 0
+        self._sort = list(sort) if sort else None
+        self._results = None
+        self._empty = False
+
+    def _check_not_started(self):
+        if self._results is not None:
+            raise InvalidOperation(
+                'cannot set options after executing query')
+
+    def sort(self, key_or_list, direction=None):
+        self._check_not_started()
+        self._sort = _index_key(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._check_not_started()
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._check_not_started()
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    def max_time_ms(self, max_time_ms):
+        self._check_not_started()
+        return self
+
+    def hint(self, index):
+        return self
+
+    def clone(self):
+        result = MemoryCursor(
+            self.collection, self._spec, self._fields, self._skip,
+            self._limit, self._sort)
+        result._empty = self._empty
+        return result
+
+    def rewind(self):
+        self._results = None
+        return self
+
+    def close(self):
+        self._results = deque()
+
+    @property
+    def alive(self):
+        return self._results is None or bool(self._results)
+
+    def _select(self, with_limit_and_skip=True):
+        if self._empty:
+            return [], None, 0
+        skip = limit = 0
+        if with_limit_and_skip:
+            skip, limit = self._skip, abs(self._limit)
+        return self.collection._select(self._spec, self._sort, skip, limit)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._results is None:
+            records, _, _ = self._select()
+            fields = self._fields
+            self._results = deque(
+                _project(doc, fields) for _, doc in records)
+        if not self._results:
+            raise StopIteration
+        return self._results.popleft()
+
+    __next__ = next
+
+    def __getitem__(self, index):
+        self._check_not_started()
+        if isinstance(index, slice):
+            if index.step is not None:
+                raise IndexError('Cursor instances do not support slice steps')
+            start = index.start or 0
+            if start < 0 or (index.stop is not None and index.stop < 0):
+                raise IndexError(
+                    'Cursor instances do not support negative indices')
+            result = self.clone()
+            result._skip = self._skip + start
+            if index.stop is not None:
+                result._limit = index.stop - start
+                result._empty = index.stop <= start
+            return result
+        if index < 0:
+            raise IndexError(
+                'Cursor instances do not support negative indices')
+        result = self.clone()
+        result._skip = self._skip + index
+        result._limit = -1
+        for doc in result:
+            return doc
+        raise IndexError('no such item for Cursor instance')
+
+    def count(self, with_limit_and_skip=False):
+        records, _, _ = self._select(with_limit_and_skip)
+        return len(records)
+
+    def distinct(self, key):
+        result = []
+        seen = set()
+        for _, doc in self._select()[0]:
+            for value in _elements(_resolve(doc, key)):
+                value_key = _sort_key(value)
+                if value is not None and value_key not in seen:
+                    seen.add(value_key)
+                    result.append(_copy(value))
+        return result
+
+    def explain(self):
+        """
+        Returns plan of the query in the format of mongo 2.x: index used
+        (``BtreeCursor <name>`` or ``BasicCursor`` for full scan), number
+        of returned and examined documents.
+        """
+        records, index_name, examined = self._select()
+        return {
+            'cursor': 'BtreeCursor {}'.format(index_name) if index_name
+            else 'BasicCursor',
+            'n': len(records),
+            'nscannedObjects': examined,
+        }
+
+
+class MemoryCommandCursor(object):
+    """
+    Iterator over aggregation results.
+    """
+    def __init__(self, results):
+        self._results = deque(results)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self._results:
+            raise StopIteration
+        return self._results.popleft()
+
+    __next__ = next
+
+    def batch_size(self, batch_size):
+        return self
+
+    def close(self):
+        self._results.clear()
+
+    @property
+    def alive(self):
+        return bool(self._results)
+
+
+class MemoryBulkOperationBuilder(object):
+    """
+    Operations on documents selected by ``MemoryBulk.find``.
+    """
+    def __init__(self, bulk, spec, upsert=False):
+        self._bulk = bulk
+        self._spec = spec
+        self._upsert = upsert
+
+    def upsert(self):
+        return MemoryBulkOperationBuilder(self._bulk, self._spec, True)
+
+    def _update(self, document, multi):
+        self._bulk._ops.append(
+            ('update', (self._spec, document, self._upsert, multi)))
+
+    def update_one(self, update):
+        if not _is_update(update):
+            raise ValueError('update only works with $ operators')
+        self._update(update, False)
+
+    def update(self, update):
+        if not _is_update(update):
+            raise ValueError('update only works with $ operators')
+        self._update(update, True)
+
+    def replace_one(self, replacement):
+        if replacement and _is_update(replacement):
+            raise ValueError('replacement can not include $ operators')
+        self._update(replacement, False)
+
+    def remove_one(self):
+        self._bulk._ops.append(('remove', (self._spec, False)))
+
+    def remove(self):
+        self._bulk._ops.append(('remove', (self._spec, True)))
+
+
+class MemoryBulk(object):
+    """
+    Counterpart of pymongo ``BulkOperationBuilder``, queued operations
+    are applied one by one on ``execute``.
+    """
+    def __init__(self, collection, ordered=True):
+        self.collection = collection
+        self.ordered = ordered
+        self._ops = []
+        self._executed = False
+
+    def find(self, selector):
+        return MemoryBulkOperationBuilder(self, selector)
+
+    def insert(self, document):
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        self._ops.append(('insert', (document,)))
+
+    def execute(self, write_concern=None):
+        if self._executed:
+            raise InvalidOperation('Bulk operations can only be executed once')
+        if not self._ops:
+            raise InvalidOperation('No operations to execute')
+        self._executed = True
+
+        result = {
+            'writeErrors': [], 'writeConcernErrors': [], 'upserted': [],
+            'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0,
+            'nRemoved': 0}
+        collection = self.collection
+        for index, (name, args) in enumerate(self._ops):
+            try:
+                if name == 'insert':
+                    collection.insert(args[0])
+                    result['nInserted'] += 1
+                elif name == 'update':
+                    spec, document, upsert, multi = args
+                    status = collection.update(
+                        spec, document, upsert=upsert, multi=multi)
+                    if 'upserted' in status:
+                        result['nUpserted'] += 1
+                        result['upserted'].append(
+                            {'index': index, '_id': status['upserted']})
+                    else:
+                        result['nMatched'] += status['n']
+                        result['nModified'] += status['nModified']
+                else:
+                    spec, multi = args
+                    status = collection.remove(spec, multi=multi)
+                    result['nRemoved'] += status['n']
+            except OperationFailure as ex:
+                result['writeErrors'].append({
+                    'index': index, 'code': ex.code or 2,
+                    'errmsg': six.text_type(ex), 'op': args[0]})
+                if self.ordered:
+                    break
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+        return result
+
+
+class MemoryCollection(object):
+    """
+    Stores documents in memory and implements pymongo 2 ``Collection``
+    methods used by ``ognom.collection.Collection``. Thread safe.
+    """
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = '{}.{}'.format(database.name, name)
+        self._lock = threading.RLock()
+        self._records = OrderedDict()  # record id -> document
+        self._record_ids = count()
+        self._indexes = OrderedDict()
+        self._indexes['_id_'] = _Index('_id_', [('_id', 1)], unique=True)
+
+    def __repr__(self):
+        return 'MemoryCollection({!r})'.format(self.full_name)
+
+    # storage
+
+    def _store(self, doc, record_id=None):
+        # inserts new record or replaces existing one
+        indexes = self._indexes.values()
+        for index in indexes:
+            index.check(doc, record_id)
+        if record_id is None:
+            record_id = next(self._record_ids)
+        else:
+            for index in indexes:
+                index.remove(self._records[record_id], record_id)
+        for index in indexes:
+            index.add(doc, record_id)
+        self._records[record_id] = doc
+        return record_id
+
+    def _delete(self, record_id):
+        doc = self._records.pop(record_id)
+        for index in self._indexes.values():
+            index.remove(doc, record_id)
+
+    def _expire(self):
+        # documents of TTL indexes are removed before each operation
+        for index in list(self._indexes.values()):
+            ttl = index.options.get('expireAfterSeconds')
+            if ttl is None:
+                continue
+            deadline = datetime.utcnow() - timedelta(seconds=ttl)
+            for record_id in index.range(upper=deadline, include_upper=False):
+                if record_id in self._records:
+                    self._delete(record_id)
+
+    def _plan(self, spec):
+        """
+        Returns (index name, ids of candidate records) for the most
+        selective index usable for ``spec`` or None for full scan.
+        """
+        best = None
+        for key, condition in spec.items():
+            if key == '$and':
+                plans = [self._plan(query) for query in condition]
+            elif key == '$or':
+                plans = [self._plan(query) for query in condition]
+                if not plans or any(plan is None for plan in plans):
+                    continue
+                plans = [(
+                    ','.join(sorted(set(name for name, _ in plans))),
+                    set().union(*(ids for _, ids in plans)))]
+            elif key.startswith('$'):
+                continue
+            else:
+                plans = []
+                for index in self._indexes.values():
+                    if index.field == key:
+                        ids = index.lookup(condition)
+                        if ids is not None:
+                            plans.append((index.name, ids))
+            for plan in plans:
+                if plan is not None and (
+                        best is None or len(plan[1]) < len(best[1])):
+                    best = plan
+        return best
+
+    def _select(self, spec=None, sort=None, skip=0, limit=0):
+        """
+        Returns list of matching (record id, document) pairs, name of used
+        index and number of examined documents.
+        """
+        spec = spec or {}
+        with self._lock:
+            self._expire()
+            plan = self._plan(spec)
+            if plan is None:
+                index_name = None
+                records = list(self._records.items())
+            else:
+                index_name, ids = plan
+                records = [
+                    (record_id, self._records[record_id])
+                    for record_id in sorted(ids)]
+
+            stop = None
+            if limit and not sort:
+                stop = skip + limit
+            matched = []
+            examined = 0
+            for record in records:
+                examined += 1
+                if _match(record[1], spec):
+                    matched.append(record)
+                    if stop is not None and len(matched) >= stop:
+                        break
+        if sort:
+            matched = _sort(matched, sort, lambda record: record[1])
+        if skip:
+            matched = matched[skip:]
+        if limit:
+            matched = matched[:limit]
+        return matched, index_name, examined
+
+    # queries
+
+    def find(self, spec=None, fields=None, skip=0, limit=0, sort=None,
+             **kwargs):
+        """
+        Other pymongo arguments (timeout, batch_size and so on) are
+        accepted and ignored.
+        """
+        return MemoryCursor(self, spec, fields, skip, limit, sort)
+
+    def find_one(self, spec_or_id=None, *args, **kwargs):
+        if spec_or_id is not None and not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id': spec_or_id}
+        for doc in self.find(spec_or_id, *args, **kwargs).limit(-1):
+            return doc
+        return None
+
+    def count(self):
+        with self._lock:
+            self._expire()
+            return len(self._records)
+
+    def aggregate(self, pipeline, **kwargs):
+        """
+        Returns ``MemoryCommandCursor`` if ``cursor`` option is passed,
+        otherwise result document like mongo 2.4.
+        """
+        stages = list(pipeline)
+        spec = None
+        if stages and list(stages[0]) == ['$match']:
+            spec = stages.pop(0)['$match']
+        docs = [_copy(doc) for _, doc in self._select(spec)[0]]
+
+        for stage in stages:
+            (name, argument), = stage.items()
+            if name == '$match':
+                docs = [doc for doc in docs if _match(doc, argument)]
+            elif name == '$sort':
+                docs = _sort(docs, argument.items())
+            elif name == '$skip':
+                docs = docs[argument:]
+            elif name == '$limit':
+                docs = docs[:argument]
+            elif name == '$project':
+                docs = _project_stage(docs, argument)
+            elif name == '$group':
+                docs = _group(docs, argument)
+            elif name == '$unwind':
+                docs = _unwind(docs, argument)
+            elif name == '$lookup':
+                other = self.database[argument['from']]
+                for doc in docs:
+                    values = _elements(_resolve(doc, argument['localField']))
+                    found = other._select(
+                        {argument['foreignField']: {'$in': values}})[0]
+                    _update_set(
+                        doc, argument['as'],
+                        [found_doc for _, found_doc in found])
+            elif name == '$count':
+                docs = [{argument: len(docs)}]
+            else:
+                raise OperationFailure(
+                    'Unsupported pipeline stage {}'.format(name))
+
+        if 'cursor' in kwargs:
+            return MemoryCommandCursor(docs)
+        return {'result': docs, 'ok': 1.0}
+
+    # writes
+
+    def insert(self, doc_or_docs, manipulate=True, safe=None,
+               check_keys=True, continue_on_error=False, **kwargs):
+        single = isinstance(doc_or_docs, dict)
+        docs = [doc_or_docs] if single else list(doc_or_docs)
+        if not docs:
+            raise InvalidOperation('cannot do an empty bulk insert')
+
+        ids = []
+        error = None
+        with self._lock:
+            self._expire()
+            for doc in docs:
+                if '_id' not in doc:
+                    if manipulate:
+                        doc['_id'] = ObjectId()
+                    else:
+                        doc = dict(doc, _id=ObjectId())
+                stored = _normalize(doc, check_keys)
+                try:
+                    self._store(stored)
+                except DuplicateKeyError as ex:
+                    if not continue_on_error:
+                        raise
+                    error = ex
+                    continue
+                ids.append(stored['_id'])
+        if error is not None:
+            raise error
+        return ids[0] if single else ids
+
+    def save(self, to_save, manipulate=True, safe=None, check_keys=True,
+             **kwargs):
+        if '_id' not in to_save:
+            return self.insert(to_save, manipulate, check_keys=check_keys)
+        self.update(
+            {'_id': to_save['_id']}, to_save, upsert=True,
+            check_keys=check_keys)
+        return to_save['_id']
+
+    def update(self, spec, document, upsert=False, manipulate=False,
+               safe=None, multi=False, check_keys=True, **kwargs):
+        if multi and not _is_update(document):
+            raise OperationFailure('multi update only works with $ operators')
+        result = {
+            'ok': 1.0, 'n': 0, 'nModified': 0, 'updatedExisting': False}
+        with self._lock:
+            records = self._select(spec, limit=0 if multi else 1)[0]
+            for record_id, doc in records:
+                new_doc = _updated(doc, document)
+                if new_doc != doc:
+                    self._store(new_doc, record_id)
+                    result['nModified'] += 1
+                result['n'] += 1
+            if records:
+                result['updatedExisting'] = True
+            elif upsert:
+                new_doc = _upserted(spec, document)
+                self._store(new_doc)
+                result['n'] = 1
+                result['upserted'] = new_doc['_id']
+        if kwargs.get('w') == 0:
+            return None
+        return result
+
+    def remove(self, spec_or_id=None, safe=None, multi=True, **kwargs):
+        if spec_or_id is None:
+            spec_or_id = {}
+        elif not isinstance(spec_or_id, dict):
+            spec_or_id = {'_id': spec_or_id}
+        with self._lock:
+            records = self._select(spec_or_id, limit=0 if multi else 1)[0]
+            for record_id, _ in records:
+                self._delete(record_id)
+        if kwargs.get('w') == 0:
+            return None
+        return {'ok': 1.0, 'n': len(records)}
+
+    def find_and_modify(self, query=None, update=None, upsert=False,
+                        sort=None, full_response=False, manipulate=False,
+                        new=False, fields=None, remove=False, **kwargs):
+        if (update is None) == (not remove):
+            raise OperationFailure('Must specify either remove or update')
+        query = query or {}
+        last_error = {'n': 0, 'updatedExisting': False}
+        with self._lock:
+            records = self._select(query, sort, limit=1)[0]
+            value = None
+            if records:
+                record_id, doc = records[0]
+                last_error['n'] = 1
+                value = doc
+                if remove:
+                    self._delete(record_id)
+                else:
+                    last_error['updatedExisting'] = True
+                    new_doc = _updated(doc, update)
+                    self._store(new_doc, record_id)
+                    if new:
+                        value = new_doc
+            elif upsert and not remove:
+                new_doc = _upserted(query, update)
+                self._store(new_doc)
+                last_error['n'] = 1
+                last_error['upserted'] = new_doc['_id']
+                if new:
+                    value = new_doc
+            if value is not None:
+                value = _project(value, fields)
+        if full_response:
+            return {'value': value, 'lastErrorObject': last_error, 'ok': 1.0}
+        return value
+
+    def initialize_ordered_bulk_op(self):
+        return MemoryBulk(self, ordered=True)
+
+    def initialize_unordered_bulk_op(self):
+        return MemoryBulk(self, ordered=False)
+
+    def drop(self):
+        self.database.drop_collection(self.name)
+
+    # indexes
+
+    def create_index(self, key_or_list, cache_for=300, **kwargs):
+        key = _index_key(key_or_list)
+        name = kwargs.pop('name', None) or '_'.join(
+            '{}_{}'.format(field, direction) for field, direction in key)
+        kwargs.pop('drop_dups', None)
+        kwargs.pop('dropDups', None)
+        with self._lock:
+            existing = self._indexes.get(name)
+            if existing is not None:
+                if existing.key != key:
+                    raise OperationFailure(
+                        'Index with name {} already exists with different '
+                        'key'.format(name))
+                return name
+            index = _Index(name, key, **kwargs)
+            index.rebuild(self._records)
+            self._indexes[name] = index
+        return name
+
+    ensure_index = create_index
+
+    def index_information(self):
+        with self._lock:
+            return {
+                name: index.information()
+                for name, index in self._indexes.items()}
+
+    def drop_index(self, index_or_name):
+        name = index_or_name
+        if not isinstance(name, six.string_types):
+            key = _index_key(index_or_name)
+            name = '_'.join(
+                '{}_{}'.format(field, direction) for field, direction in key)
+        if name == '_id_':
+            raise OperationFailure('cannot drop _id index')
+        with self._lock:
+            if self._indexes.pop(name, None) is None:
+                raise OperationFailure('index not found with name [{}]'.format(
+                    name))
+
+    def drop_indexes(self):
+        with self._lock:
+            for name in list(self._indexes):
+                if name != '_id_':
+                    del self._indexes[name]
+
+
+class MemoryDatabase(object):
+    """
+    Collections are created on first access by attribute or item.
+    """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'MemoryDatabase({!r})'.format(self.name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = self._collections[name] = MemoryCollection(
+                    self, name)
+            return collection
+
+    def collection_names(self, include_system_collections=True):
+        return sorted(self._collections)
+
+    def drop_collection(self, name_or_collection):
+        name = getattr(name_or_collection, 'name', name_or_collection)
+        with self._lock:
+            self._collections.pop(name, None)
+
+
+class MemoryClient(object):
+    """
+    Stand-in for ``MongoClient``, connection arguments are accepted and
+    ignored. Every client keeps its own databases.
+    """
+    def __init__(self, *args, **kwargs):
+        self._databases = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        with self._lock:
+            database = self._databases.get(name)
+            if database is None:
+                database = self._databases[name] = MemoryDatabase(self, name)
+            return database
+
+    def database_names(self):
+        return sorted(self._databases)
+
+    def drop_database(self, name_or_database):
+        name = getattr(name_or_database, 'name', name_or_database)
+        with self._lock:
+            self._databases.pop(name, None)
+
+    def close(self):
+        pass
@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+import json
+import uuid
+import datetime
+import decimal
+
+from bson import ObjectId
+
+from ognom.fields import ValidationError
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def _default(value):
+    # same representation as produced by fields jsonify
+    if isinstance(value, (ObjectId, uuid.UUID, decimal.Decimal)):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S%z')
+    if hasattr(value, 'jsonify'):
+        return value.jsonify()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+_encoder = json.JSONEncoder(default=_default)
+
+
+def iter_json(docs, chunk_size=DEFAULT_CHUNK_SIZE, encoding=None):
+    """
+    Encodes documents as JSON array chunk by chunk, so only one document
+    and one chunk are kept in memory at a time. Could be used as WSGI
+    response body.
+    :param docs: iterable of documents or dicts, for example
+        ``CursorWrapper``;
+    :param chunk_size: approximate size of produced chunks in characters;
+    :param encoding: if specified chunks are encoded to bytes.
+    """
+    encode = _encoder.encode
+    buf = ['[']
+    size = 1
+    separator = ''
+    for doc in docs:
+        if hasattr(doc, 'jsonify'):
+            doc = doc.jsonify()
+        text = encode(doc)
+        buf.append(separator)
+        buf.append(text)
+        separator = ','
+        size += len(text) + 1
+        if size >= chunk_size:
+            chunk = ''.join(buf)
+            yield chunk.encode(encoding) if encoding else chunk
+            buf = []
+            size = 0
+    buf.append(']')
+    chunk = ''.join(buf)
+    yield chunk.encode(encoding) if encoding else chunk
+
+
+def write_json(docs, fp, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Writes documents as JSON array to file-like object ``fp``.
+    """
+    for chunk in iter_json(docs, chunk_size):
+        fp.write(chunk)
+
+
+def read_ndjson(doc_cls, lines, errors=None):
+    """
+    Yields documents of ``doc_cls`` parsed from NDJSON lines one by one,
+    so memory usage doesn't depend on the size of input.
+    :param lines: iterable of lines, for example file object;
+    :param errors: if list is passed, lines failed to parse or convert are
+        skipped and (line number, ``ValidationError``) pairs are appended
+        to it, otherwise the first error is raised.
+    """
+    loads = json.loads
+    from_json = doc_cls.from_json
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield from_json(loads(line))
+        except (ValidationError, ValueError, TypeError) as ex:
+            if errors is None:
+                raise
+            if not isinstance(ex, ValidationError):
+                ex = ValidationError(repr(ex))
+            errors.append((line_number, ex))
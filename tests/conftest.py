@@ -1,9 +1,15 @@
+import os
+
 from ognom.connection import ConnectionManager
 
 
 def pytest_configure(config):
-    connection_manager = ConnectionManager()
-    connection_manager.connect({'main': {
+    settings = {
         'name': 'master_common_test',
-        'args': ['127.0.0.1:27017']}})
+        'args': ['127.0.0.1:27017']}
+    # OGNOM_TEST_BACKEND=memory runs the suite without mongod
+    if os.environ.get('OGNOM_TEST_BACKEND'):
+        settings['backend'] = os.environ['OGNOM_TEST_BACKEND']
+    connection_manager = ConnectionManager()
+    connection_manager.connect({'main': settings})
 
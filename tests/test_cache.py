@@ -0,0 +1,91 @@
+import unittest
+
+from bson.son import SON
+
+from ognom.cache import LRUCache, canonical_key
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = LRUCache()
+        assert cache.get('a') is None
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        assert cache.stats() == {
+            'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+    def test_should_evict_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.evictions == 1
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.set('a', 1)
+        clock.now = 9
+        assert cache.get('a') == 1
+        clock.now = 10
+        assert cache.get('a') is None
+        assert cache.misses == 1
+
+    def test_invalidation(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.pop('a') == 1
+        assert cache.get('a') is None
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_set_should_skip_stale_values(self):
+        cache = LRUCache()
+        version = cache.version
+        cache.pop('a')
+        cache.set('a', 1, version)
+        assert cache.get('a') is None
+        cache.set('a', 1, cache.version)
+        assert cache.get('a') == 1
+
+
+class TestCanonicalKey(unittest.TestCase):
+    def test_should_ignore_order_of_query_keys(self):
+        assert canonical_key(
+            spec={'a': 1, 'b': {'$gt': 1, '$lt': 5}}, limit=10) == \
+            canonical_key(
+                limit=10, spec={'b': {'$lt': 5, '$gt': 1}, 'a': 1})
+        assert canonical_key(
+            spec={'$or': [{'a': 1, 'b': 2}]}) == canonical_key(
+                spec={'$or': [{'b': 2, 'a': 1}]})
+
+    def test_should_keep_order_of_embedded_documents(self):
+        assert canonical_key(spec={'a': SON([('x', 1), ('y', 2)])}) != \
+            canonical_key(spec={'a': SON([('y', 2), ('x', 1)])})
+        assert canonical_key(sort=[('a', 1), ('b', 1)]) != \
+            canonical_key(sort=[('b', 1), ('a', 1)])
+        for operator in ('$in', '$nin', '$all'):
+            assert canonical_key(spec={'a': {operator: [
+                SON([('x', 1), ('y', 2)])]}}) != canonical_key(
+                    spec={'a': {operator: [SON([('y', 2), ('x', 1)])]}})
+
+    def test_should_distinguish_types(self):
+        assert canonical_key(spec={'a': 1}) != canonical_key(
+            spec={'a': True})
+
+    def test_unhashable(self):
+        with self.assertRaises(TypeError):
+            canonical_key(spec={'a': bytearray(b'a')})
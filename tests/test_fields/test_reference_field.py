@@ -0,0 +1,117 @@
+import unittest
+
+import pytest
+from bson import ObjectId
+
+from ognom.collection import Collection
+from ognom.document import Document
+from ognom.fields import ReferenceField, StringField, ValidationError
+
+
+class Author(Document):
+    objects = Collection(db_name='main', collection_name='test_authors')
+
+    name = StringField()
+
+
+class Post(Document):
+    objects = Collection(db_name='main', collection_name='test_posts')
+
+    title = StringField()
+    author = ReferenceField(Author)
+
+
+class TestReferenceField(unittest.TestCase):
+    def test_should_accept_string_as_model_class(self):
+        field = ReferenceField(
+            'tests.test_fields.test_reference_field.Author')
+        assert field.model_class == Author
+
+    def test_should_store_id_only(self):
+        author = Author(_id=ObjectId(), name='a')
+        post = Post(title='t', author=author)
+        assert post.to_mongo() == {'title': 't', 'author': author.id}
+        assert post.jsonify()['author'] == str(author.id)
+        post.author = str(author.id)
+        assert post._data['author'] == author.id
+
+    def test_validate(self):
+        post = Post(author=Author(name='a'))
+        with pytest.raises(ValidationError):
+            post.validate()
+        with pytest.raises(ValidationError):
+            post.author = 'invalid'
+
+
+class TestReferenceDereferencing(unittest.TestCase):
+    def setUp(self):
+        Author.objects.remove()
+        Post.objects.remove()
+        self.authors = [
+            Author.objects.create({'name': 'author{}'.format(i)})
+            for i in range(3)]
+        for i in range(6):
+            Post.objects.create({
+                'title': 'post{}'.format(i),
+                'author': self.authors[i % 3]})
+
+    def tearDown(self):
+        Author.objects.remove()
+        Post.objects.remove()
+
+    def _count_author_queries(self, method_name):
+        collection = Author.objects.collection
+        calls = []
+        method = getattr(collection, method_name)
+
+        def counting(*args, **kwargs):
+            calls.append(kwargs)
+            return method(*args, **kwargs)
+        setattr(collection, method_name, counting)
+        self.addCleanup(delattr, collection, method_name)
+        return calls
+
+    def test_lazy_dereferencing(self):
+        post = Post.objects.get({'title': 'post0'})
+        assert Post.author.get_id(post) == self.authors[0].id
+        calls = self._count_author_queries('find_one')
+        assert post.author.name == 'author0'
+        assert post.author.name == 'author0'
+        assert len(calls) == 1
+        assert post._changed == set()
+        post.title = 'changed'
+        Post.objects.save(post)
+        stored = Post.objects.collection.find_one({'_id': post.id})
+        assert stored['author'] == self.authors[0].id
+
+    def test_select_related(self):
+        calls = self._count_author_queries('find')
+        posts = Post.objects.find().select_related('author').as_list()
+        assert len(calls) == 1
+        assert [post.author.name for post in posts] == [
+            'author{}'.format(i % 3) for i in range(6)]
+        assert len(calls) == 1
+
+    def test_select_related_unknown_field(self):
+        with pytest.raises(ValueError):
+            Post.objects.find().select_related('title').as_list()
+
+    def test_find_with_lookup(self):
+        calls = self._count_author_queries('find_one')
+        posts = Post.objects.find(
+            {'title': {'$in': ['post1', 'post2', 'post4']}},
+            sort=[('title', -1)], limit=2, lookup=['author']).as_list()
+        assert [post.title for post in posts] == ['post4', 'post2']
+        assert Post.author.is_resolved(posts[0])
+        assert [post.author.name for post in posts] == [
+            'author1', 'author2']
+        assert posts[0]._changed == set()
+        assert 'author' not in posts[0].to_mongo_update()
+        assert calls == []
+
+    def test_find_with_lookup_of_missing_reference(self):
+        Author.objects.remove(self.authors[0])
+        posts = Post.objects.find(
+            {'title': 'post0'}, lookup=['author']).as_list()
+        assert not Post.author.is_resolved(posts[0])
+        assert posts[0].author is None
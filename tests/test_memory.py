@@ -0,0 +1,280 @@
+import re
+import unittest
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import (
+    BulkWriteError, DuplicateKeyError, InvalidOperation, OperationFailure)
+
+from ognom.collection import Collection
+from ognom.connection import ConnectionManager
+from ognom.document import Document
+from ognom.fields import IntField, StringField
+from ognom.memory import MemoryClient
+
+
+class TestMemoryCollection(unittest.TestCase):
+    def setUp(self):
+        self.collection = MemoryClient().test.items
+        self.collection.insert([
+            {'_id': 1, 'name': 'a', 'n': 5, 'tags': ['x', 'y'],
+             'sub': {'k': 1}},
+            {'_id': 2, 'name': 'b', 'n': 3, 'tags': ['y']},
+            {'_id': 3, 'name': 'c', 'n': 8, 'sub': {'k': 2}},
+            {'_id': 4, 'name': 'B', 'n': None},
+        ])
+
+    def ids(self, spec=None, **kwargs):
+        return [doc['_id'] for doc in self.collection.find(spec, **kwargs)]
+
+    def test_query_operators(self):
+        assert self.ids({'n': {'$gt': 3}}) == [1, 3]
+        assert self.ids({'n': {'$gte': 3, '$lt': 8}}) == [1, 2]
+        assert self.ids({'n': {'$ne': 5}}) == [2, 3, 4]
+        assert self.ids({'n': None}) == [4]
+        assert self.ids({'tags': 'y'}) == [1, 2]
+        assert self.ids({'tags': {'$all': ['x', 'y']}}) == [1]
+        assert self.ids({'tags': {'$size': 1}}) == [2]
+        assert self.ids({'tags': {'$exists': False}}) == [3, 4]
+        assert self.ids({'sub.k': {'$in': [2, 7]}}) == [3]
+        assert self.ids({'name': {'$nin': ['a', 'b']}}) == [3, 4]
+        assert self.ids({'name': re.compile('^b$', re.I)}) == [2, 4]
+        assert self.ids({'name': {'$regex': '^B', '$options': 'i'}}) == [2, 4]
+        assert self.ids({'n': {'$not': {'$gt': 4}}}) == [2, 4]
+        assert self.ids({'n': {'$mod': [4, 0]}}) == [3]
+        assert self.ids({'$or': [{'n': 3}, {'name': 'c'}]}) == [2, 3]
+        assert self.ids({'$nor': [{'n': 3}, {'name': 'c'}]}) == [1, 4]
+        assert self.ids({'$and': [{'n': {'$gt': 3}}, {'sub.k': 1}]}) == [1]
+        with pytest.raises(OperationFailure):
+            self.ids({'n': {'$where': 1}})
+
+    def test_elem_match(self):
+        self.collection.insert({'_id': 5, 'items': [
+            {'a': 1, 'b': 2}, {'a': 2, 'b': 1}]})
+        assert self.ids({'items': {'$elemMatch': {'a': 1, 'b': 2}}}) == [5]
+        assert self.ids({'items': {'$elemMatch': {'a': 1, 'b': 1}}}) == []
+
+    def test_sort_skip_limit(self):
+        assert self.ids(sort=[('n', -1)]) == [3, 1, 2, 4]
+        assert self.ids(sort=[('n', 1)], skip=1, limit=2) == [2, 1]
+        cursor = self.collection.find().sort('name', 1)
+        assert [doc['name'] for doc in cursor] == ['B', 'a', 'b', 'c']
+        with pytest.raises(InvalidOperation):
+            cursor.limit(1)
+        cursor = self.collection.find().sort('_id', 1)
+        assert cursor[2]['_id'] == 3
+        assert [doc['_id'] for doc in cursor[1:3]] == [2, 3]
+        assert self.collection.find({'n': {'$gt': 0}}).count() == 3
+        assert self.collection.find().limit(1).count(True) == 1
+        assert sorted(self.collection.find().distinct('tags')) == ['x', 'y']
+
+    def test_sort_empty_array(self):
+        self.collection.insert([
+            {'_id': 5, 'tags': []}, {'_id': 6, 'tags': ['a']}])
+        assert self.ids({'_id': {'$gt': 2}}, sort=[('tags', 1)]) == \
+            [5, 3, 4, 6]
+        assert self.ids({'_id': {'$gt': 2}}, sort=[('tags', -1)]) == \
+            [6, 3, 4, 5]
+        result = self.collection.aggregate([
+            {'$match': {'_id': {'$gt': 4}}}, {'$sort': {'tags': 1}}])
+        assert [doc['_id'] for doc in result['result']] == [5, 6]
+
+    def test_projection(self):
+        doc = self.collection.find_one(1, {'name': 1})
+        assert doc == {'_id': 1, 'name': 'a'}
+        doc = self.collection.find_one(1, {'sub.k': 1, '_id': 0})
+        assert doc == {'sub': {'k': 1}}
+        doc = self.collection.find_one(1, {'tags': 0, 'sub': 0, 'n': 0})
+        assert doc == {'_id': 1, 'name': 'a'}
+        doc = self.collection.find_one(1, {'tags': {'$slice': 1}})
+        assert doc['tags'] == ['x'] and doc['name'] == 'a'
+        with pytest.raises(OperationFailure):
+            self.collection.find_one(1, {'name': 1, 'n': 0})
+
+    def test_returned_documents_are_copies(self):
+        doc = self.collection.find_one(1)
+        doc['tags'].append('z')
+        assert self.collection.find_one(1)['tags'] == ['x', 'y']
+
+    def test_update(self):
+        status = self.collection.update({'_id': 1}, {
+            '$set': {'sub.k': 3, 'new': 1}, '$inc': {'n': 2},
+            '$push': {'tags': 'z'}, '$unset': {'name': ''}})
+        assert status['n'] == 1 and status['updatedExisting']
+        assert self.collection.find_one(1) == {
+            '_id': 1, 'n': 7, 'tags': ['x', 'y', 'z'], 'sub': {'k': 3},
+            'new': 1}
+        self.collection.update({'_id': 1}, {
+            '$addToSet': {'tags': {'$each': ['x', 'w']}},
+            '$pull': {'tags': 'y'}, '$max': {'n': 1}, '$min': {'n': 6},
+            '$rename': {'new': 'old'}})
+        assert self.collection.find_one(1) == {
+            '_id': 1, 'n': 6, 'tags': ['x', 'z', 'w'], 'sub': {'k': 3},
+            'old': 1}
+        status = self.collection.update(
+            {'n': {'$gt': 0}}, {'$set': {'flag': True}}, multi=True)
+        assert status['n'] == 3
+        with pytest.raises(OperationFailure):
+            self.collection.update({'_id': 2}, {'$set': {'_id': 7}})
+        with pytest.raises(OperationFailure):
+            self.collection.update({}, {'name': 'x'}, multi=True)
+
+    def test_replace_and_upsert(self):
+        self.collection.update({'_id': 2}, {'name': 'bb'})
+        assert self.collection.find_one(2) == {'_id': 2, 'name': 'bb'}
+        status = self.collection.update(
+            {'name': 'd', 'n': {'$gt': 1}},
+            {'$set': {'x': 1}, '$setOnInsert': {'y': 2}}, upsert=True)
+        doc = self.collection.find_one(status['upserted'])
+        assert isinstance(doc['_id'], ObjectId)
+        assert (doc['name'], doc['x'], doc['y']) == ('d', 1, 2)
+        assert 'n' not in doc
+        self.collection.update(
+            {'name': 'd'}, {'$set': {'x': 2}, '$setOnInsert': {'y': 3}},
+            upsert=True)
+        assert self.collection.find_one({'name': 'd'})['y'] == 2
+
+    def test_remove_and_find_and_modify(self):
+        assert self.collection.remove({'n': {'$lt': 6}})['n'] == 2
+        assert self.ids() == [3, 4]
+        doc = self.collection.find_and_modify(
+            {'_id': 3}, {'$inc': {'n': 1}}, new=True)
+        assert doc['n'] == 9
+        doc = self.collection.find_and_modify({'_id': 4}, remove=True)
+        assert doc['_id'] == 4
+        assert self.ids() == [3]
+
+    def test_unique_index(self):
+        self.collection.ensure_index([('name', 1)], unique=True)
+        with pytest.raises(DuplicateKeyError):
+            self.collection.insert({'name': 'a'})
+        with pytest.raises(DuplicateKeyError):
+            self.collection.update({'_id': 2}, {'$set': {'name': 'a'}})
+        with pytest.raises(DuplicateKeyError):
+            self.collection.insert({'_id': 1})
+        with pytest.raises(DuplicateKeyError):
+            self.collection.ensure_index([('sub.k', 1), ('x', 1)],
+                                         unique=True, name='broken')
+        assert 'broken' not in self.collection.index_information()
+
+    def test_index_usage(self):
+        self.collection.ensure_index([('n', 1)])
+        information = self.collection.index_information()
+        assert information['n_1'] == {'key': [('n', 1)], 'v': 1}
+
+        plan = self.collection.find({'n': {'$gte': 5}}).explain()
+        assert plan == {
+            'cursor': 'BtreeCursor n_1', 'n': 2, 'nscannedObjects': 2}
+        plan = self.collection.find({'n': {'$in': [3, 8]}}).explain()
+        assert plan['cursor'] == 'BtreeCursor n_1'
+        assert plan['nscannedObjects'] == 2
+        plan = self.collection.find({'name': 'a'}).explain()
+        assert plan['cursor'] == 'BasicCursor'
+        assert plan['nscannedObjects'] == 4
+
+        self.collection.update({'_id': 2}, {'$set': {'n': 6}})
+        self.collection.remove({'_id': 3})
+        assert self.ids({'n': {'$gt': 5}}) == [2]
+        self.collection.drop_index('n_1')
+        assert list(self.collection.index_information()) == ['_id_']
+
+    def test_index_range_over_arrays(self):
+        self.collection.insert([
+            {'_id': 10, 'a': [0, 10]}, {'_id': 11, 'a': 3},
+            {'_id': 12, 'a': [6, 7]}])
+        specs = [
+            {'a': {'$gt': 1, '$lt': 5}},
+            {'a': {'$gte': 0, '$lte': 0}},
+            {'a': {'$gt': 5, '$lt': 8}}]
+        expected = [self.ids(spec) for spec in specs]
+        assert expected[0] == [10, 11]
+        self.collection.ensure_index([('a', 1)])
+        assert [self.ids(spec) for spec in specs] == expected
+        self.collection.update({'_id': 10}, {'$set': {'a': 0}})
+        assert self.ids(specs[0]) == [11]
+
+    def test_ttl_index(self):
+        self.collection.insert([
+            {'_id': 10, 'at': datetime.utcnow() - timedelta(hours=1)},
+            {'_id': 11, 'at': datetime.utcnow() + timedelta(hours=1)}])
+        self.collection.ensure_index('at', expireAfterSeconds=60)
+        assert self.ids({'at': {'$exists': True}}) == [11]
+
+    def test_aggregate(self):
+        self.collection.database.other.insert([
+            {'_id': 'x', 'title': 'X'}, {'_id': 'y', 'title': 'Y'}])
+        result = self.collection.aggregate([
+            {'$match': {'tags': {'$exists': True}}},
+            {'$unwind': '$tags'},
+            {'$group': {'_id': '$tags', 'total': {'$sum': '$n'},
+                        'names': {'$push': '$name'}}},
+            {'$sort': {'_id': 1}},
+            {'$lookup': {'from': 'other', 'localField': '_id',
+                         'foreignField': '_id', 'as': 'other'}},
+            {'$project': {'total': 1, 'names': 1, 'title': '$other.title'}},
+        ], cursor={})
+        assert list(result) == [
+            {'_id': 'x', 'total': 5, 'names': ['a'], 'title': 'X'},
+            {'_id': 'y', 'total': 8, 'names': ['a', 'b'], 'title': 'Y'}]
+        result = self.collection.aggregate([{'$count': 'total'}])
+        assert result['result'] == [{'total': 4}]
+
+    def test_bulk(self):
+        bulk = self.collection.initialize_ordered_bulk_op()
+        bulk.insert({'_id': 5})
+        bulk.find({'_id': 1}).update_one({'$set': {'n': 0}})
+        bulk.find({'_id': 6}).upsert().update_one({'$set': {'n': 1}})
+        bulk.find({'_id': 2}).remove_one()
+        result = bulk.execute()
+        assert (result['nInserted'], result['nMatched'], result['nUpserted'],
+                result['nRemoved']) == (1, 1, 1, 1)
+        assert self.ids() == [1, 3, 4, 5, 6]
+
+        bulk = self.collection.initialize_unordered_bulk_op()
+        bulk.insert({'_id': 1})
+        bulk.insert({'_id': 7})
+        with pytest.raises(BulkWriteError) as error:
+            bulk.execute()
+        assert error.value.details['nInserted'] == 1
+        assert error.value.details['writeErrors'][0]['code'] == 11000
+
+
+class TestMemoryBackend(unittest.TestCase):
+    def setUp(self):
+        ConnectionManager.connect({'memory': {
+            'name': 'memory_test', 'backend': 'memory'}})
+
+        class MemoryDoc(Document):
+            objects = Collection(db_name='memory', collection_name='docs')
+            name = StringField()
+            n = IntField()
+
+        MemoryDoc.objects.indexes = [{'index': [('n', 1)], 'unique': True}]
+        MemoryDoc.objects.synchronize_indexes()
+        self.MemoryDoc = MemoryDoc
+
+    def tearDown(self):
+        ConnectionManager.drop_database('memory')
+        ConnectionManager.databases.pop('memory')
+        ConnectionManager.connections.pop('memory')
+
+    def test_collection(self):
+        objects = self.MemoryDoc.objects
+        assert isinstance(ConnectionManager.connections['memory'],
+                          MemoryClient)
+        for n in range(5):
+            objects.save(self.MemoryDoc(name='doc', n=n))
+        with pytest.raises(DuplicateKeyError):
+            objects.save(self.MemoryDoc(name='doc', n=1))
+
+        doc = objects.get({'n': 3})
+        doc.name = 'changed'
+        objects.save(doc)
+        assert objects.get({'name': 'changed'}).n == 3
+        assert [d.n for d in objects.find({'n': {'$gte': 3}})] == [3, 4]
+        assert objects.count() == 5
+        assert objects.find({'n': 2}).explain()['cursor'] == \
+            'BtreeCursor n_1'
+        objects.remove(doc)
+        assert objects.count() == 4
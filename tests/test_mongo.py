@@ -1,21 +1,26 @@
 # coding: utf8
+import pickle
 import uuid
+import threading
 import unittest
 import inspect
 from datetime import datetime, timedelta
 from collections import namedtuple
 
 import pytest
+from bson.errors import InvalidDocument
 from bson.objectid import ObjectId
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from six import string_types
+from ognom.cache import LRUCache
 from ognom.collection import Collection
-from ognom.document import ObjectDoesNotExist
+from ognom.document import Document, ObjectDoesNotExist
 
 from ognom.validators import EmailValidator
 from ognom.fields import (
     StringField, ObjectIdField, DateTimeField, ValidationError, UUIDField,
-    ListField, DictField, DocumentField, BooleanField, IntField, GenericField)
+    ListField, DictField, DocumentField, BooleanField, IntField, GenericField,
+    FieldNotLoaded)
 from ognom._registry import documents_registry
 from tests.common import BaseDoc
 
@@ -24,6 +29,17 @@ _ContactStatus = namedtuple(
 ContactStatus = _ContactStatus('awaiting', 'done', 'in-process', 'failed')
 
 
+# pickled documents are looked up by class name, so these are module level
+class PickledDoc(Document):
+    field1 = StringField()
+    field2 = ListField(IntField())
+
+
+class CompactPickledDoc(PickledDoc):
+    __slots__ = ()
+    field3 = DocumentField(PickledDoc)
+
+
 class TestDocument(unittest.TestCase):
 
     def test_attribute_getting(self):
@@ -147,6 +163,10 @@ class TestDocument(unittest.TestCase):
         assert isinstance(result.doc_field, ITD)
         assert result.doc_field.field1 == 'a'
         assert result.doc_field.field2 == 'b'
+        # embedded documents are in the same state as loaded ones
+        assert result.doc_field._changed == set()
+        result.doc_field.field2 = 'c'
+        assert result.doc_field._changed == {'field2'}
 
     def test_list_of_document_fields_to_mongo(self):
         class ITD(BaseDoc):
@@ -172,6 +192,29 @@ class TestDocument(unittest.TestCase):
             result['field1'],
             {'a': {'field1': 'ts'}, 'b': {'field1': 'ts'}})
 
+    def test_to_mongo_inherited_fields(self):
+        class ITD(BaseDoc):
+            field1 = IntField()
+
+        class TD(ITD):
+            field2 = ListField(DictField(IntField()))
+            field3 = StringField()
+
+        td = TD(field1='1', field2=[{'a': '2'}], field3=None)
+        td._data['unknown'] = 'value'
+        assert td.to_mongo() == {'field1': 1, 'field2': [{'a': 2}]}
+
+    def test_to_mongo_should_copy_containers(self):
+        class TD(BaseDoc):
+            field1 = ListField(StringField())
+            field2 = DictField(GenericField())
+
+        td = TD(field1=['a'], field2={'b': 'c'})
+        result = td.to_mongo()
+        assert result == {'field1': ['a'], 'field2': {'b': 'c'}}
+        assert result['field1'] is not td.field1
+        assert result['field2'] is not td.field2
+
     def test_dict_from_mongo(self):
         class TD(BaseDoc):
             field1 = DictField(GenericField())
@@ -222,6 +265,59 @@ class TestDocument(unittest.TestCase):
         td = TD.from_mongo({'field1': 'test_string'})
         assert td.field1 == 'test_string'
 
+    def test_from_mongo_defaults_only_for_missing_fields(self):
+        calls = []
+
+        def default():
+            calls.append(1)
+            return 'default'
+
+        class TD(BaseDoc):
+            field1 = StringField(default=default)
+            field2 = StringField(default=default)
+
+        td = TD.from_mongo({'field1': 'loaded', 'unknown': 'value'})
+        assert td.field1 == 'loaded'
+        assert td.field2 == 'default'
+        assert len(calls) == 1
+        assert 'unknown' not in td._data
+
+    def test_from_mongo_inherited_fields(self):
+        class ITD(BaseDoc):
+            field1 = DictField(ListField(IntField()))
+
+        class TD(ITD):
+            field2 = StringField()
+
+        _id = ObjectId()
+        td = TD.from_mongo({
+            '_id': _id, 'field1': {'a': [1, 2]}, 'field2': 'b'})
+        assert td.id == _id
+        assert td.field1 == {'a': [1, 2]}
+        assert td.field2 == 'b'
+
+    def test_from_mongo_lazy(self):
+        class ITD(BaseDoc):
+            field1 = StringField(default='test_string')
+
+        class TD(BaseDoc):
+            field1 = DocumentField(ITD)
+            field2 = ListField(DocumentField(ITD))
+            field3 = StringField(default='test_string')
+
+        payload = {'field1': {'field1': 'a'}, 'field2': [{}]}
+        td = TD.from_mongo(payload, lazy=True)
+        assert td._data.raw == payload
+        assert td.field3 == 'test_string'
+        assert isinstance(td.field1, ITD)
+        assert td.field1.field1 == 'a'
+        assert td._data.raw == {'field2': [{}]}
+        assert td.to_mongo() == {
+            'field1': {'field1': 'a'}, 'field2': [{}],
+            'field3': 'test_string'}
+        assert td.field2[0].field1 == 'test_string'
+        assert td._data.raw == {}
+
     def test_from_mongo_hierarchy(self):
         dt_now = datetime.now()
 
@@ -295,6 +391,125 @@ class TestDocument(unittest.TestCase):
         assert isinstance(td.field2['a'].field2[0], InListTD)
         assert td.field2['a'].field2[0].field1 == dt_now
 
+    def test_to_mongo_update(self):
+        class TD(BaseDoc):
+            field1 = StringField()
+            field2 = StringField()
+            field3 = IntField()
+            field4 = ListField(IntField())
+
+        td = TD.from_mongo({
+            '_id': ObjectId(), 'field1': 'a', 'field2': 'b', 'field3': 1,
+            'field4': [1]})
+        assert td.to_mongo_update() == {}
+        td.field1 = 'c'
+        td.field2 = None
+        td.field3 = '2'
+        td.field4.append(2)
+        assert td.to_mongo_update() == {
+            '$set': {'field1': 'c', 'field3': 2, 'field4': [1, 2]},
+            '$unset': {'field2': ''}}
+
+    def test_to_mongo_update_after_in_place_changes(self):
+        class TD(BaseDoc):
+            field1 = GenericField()
+            field2 = ListField(DictField(IntField()))
+
+        td = TD.from_mongo({
+            '_id': ObjectId(), 'field1': {'a': [1]}, 'field2': [{'a': 1}]})
+        td.field1['a'].append(2)
+        td.field2[0]['a'] = 2
+        update = td.to_mongo_update()
+        assert update == {
+            '$set': {'field1': {'a': [1, 2]}, 'field2': [{'a': 2}]}}
+        td._mark_stored(update)
+        assert td.to_mongo_update() == {}
+        # the values written are kept, not the current ones
+        td.field1['a'].pop()
+        assert td.to_mongo_update() == {'$set': {'field1': {'a': [1]}}}
+
+    def test_from_mongo_with_projection(self):
+        class TD(BaseDoc):
+            field1 = StringField(required=True)
+            field2 = ListField(IntField(), default=list)
+            field3 = DictField(IntField(), default=dict)
+
+        _id = ObjectId()
+        td = TD.from_mongo(
+            {'_id': _id, 'field3': {'a': 1}}, fields=['field3.a'])
+        assert td.is_partial
+        assert 'field2' not in td._data
+        assert td.field3 == {'a': 1}
+        with pytest.raises(FieldNotLoaded):
+            td.field1
+        with pytest.raises(FieldNotLoaded):
+            td.field2
+        td.validate()
+        # partially loaded field is sent only when assigned
+        assert td.to_mongo_update() == {}
+        td.field2 = [1]
+        assert td.field2 == [1]
+        assert td.to_mongo_update() == {'$set': {'field2': [1]}}
+
+        projection = TD.get_projection({'field1': 0, 'field2': {'$slice': 1}})
+        assert projection.loaded == {'_id', 'field2', 'field3'}
+        assert projection.partial == {'field2'}
+        assert TD.get_projection({'_id': 0, 'field1': 1}).loaded == {'field1'}
+        assert TD.get_projection(None) is None
+
+    def test_new_document_changes_are_not_tracked(self):
+        class TD(BaseDoc):
+            field1 = StringField()
+
+        td = TD(field1='a')
+        td.field1 = 'b'
+        assert td._changed is None
+
+    def test_from_json_many(self):
+        class ITD(BaseDoc):
+            field1 = DateTimeField()
+
+        class TD(ITD):
+            field2 = IntField()
+
+        errors = []
+        docs = list(TD.from_json_many([
+            {'field1': '2016-01-01T00:00:00', 'field2': '1'},
+            {'field2': 'not int'},
+            {'id': 'not object id'},
+        ], errors))
+        assert len(docs) == 1
+        assert docs[0].field1 == datetime(2016, 1, 1)
+        assert docs[0].field2 == 1
+        assert [index for index, _ in errors] == [1, 2]
+        assert errors[1][1].field_name == '_id'
+        with pytest.raises(ValidationError):
+            list(TD.from_json_many([{'field2': 'not int'}]))
+
+    def test_copy_should_share_immutable_values_only(self):
+        class ITD(BaseDoc):
+            field1 = ListField(IntField())
+
+        class TD(BaseDoc):
+            field1 = DateTimeField()
+            field2 = ListField(DocumentField(ITD))
+            field3 = DictField(ListField(StringField()))
+            field4 = GenericField()
+
+        td = TD(
+            _id=ObjectId(), field1=datetime.now(), field2=[ITD(field1=[1])],
+            field3={'a': ['b']}, field4={'c': ['d']})
+        td_copy = td.copy()
+        assert td_copy.id is None
+        assert td_copy.field1 is td.field1
+        assert td_copy.field2[0].field1 == [1]
+        assert td_copy.field2[0] is not td.field2[0]
+        assert td_copy.field2[0].field1 is not td.field2[0].field1
+        assert td_copy.field3 == {'a': ['b']}
+        assert td_copy.field3['a'] is not td.field3['a']
+        assert td_copy.field4 == {'c': ['d']}
+        assert td_copy.field4['c'] is not td.field4['c']
+
     def test_copy_in_place(self):
         class ITD(BaseDoc):
             field11 = IntField()
@@ -320,6 +535,51 @@ class TestDocument(unittest.TestCase):
         assert td1.field2 == td2.field2
         assert td1.field3.field11 == td2.field3.field11
 
+    def test_validate_inherited_fields(self):
+        class ITD(BaseDoc):
+            field1 = IntField()
+
+        class TD(ITD):
+            field2 = StringField()
+
+        td = TD(field1='not int')
+        self.assertRaises(ValidationError, td.validate)
+
+    def test_validate_changed_fields_only(self):
+        class TD(BaseDoc):
+            field1 = IntField()
+            field2 = StringField(required=True)
+            field3 = ListField(IntField())
+            field4 = ListField(StringField())
+
+        td = TD.from_mongo({'field1': 'not int', 'field3': [1]})
+        td.validate()
+        td.field2 = 'a'
+        td.validate()
+        td.field1 = 'not int'
+        self.assertRaises(ValidationError, td.validate)
+        td.field1 = 1
+        td.field3.append('not int')
+        self.assertRaises(ValidationError, td.validate)
+
+        # mutable fields are checked only if changed in place
+        td = TD.from_mongo({'field2': 'a', 'field4': [1]})
+        td.validate()
+        td.field4.append('a')
+        self.assertRaises(ValidationError, td.validate)
+
+    def test_validation_errors(self):
+        class TD(BaseDoc):
+            field1 = IntField()
+            field2 = StringField(required=True)
+            field3 = StringField(choices=ContactStatus)
+
+        td = TD(field1='not int', field3='unknown')
+        errors = td.validation_errors()
+        assert sorted(error.field_name for error in errors) == [
+            'field1', 'field2', 'field3']
+        assert TD(field2='a').validation_errors() == []
+
     def test_required_fields_should_not_collide(self):
         class TD1(BaseDoc):
             field1 = StringField()
@@ -363,6 +623,145 @@ class TestDocument(unittest.TestCase):
             assert True
 
 
+class TestCompactDocument(unittest.TestCase):
+    def setUp(self):
+        class ITD(Document):
+            __slots__ = ()
+            field1 = StringField(default='test_string')
+            field2 = IntField()
+
+        class TD(ITD):
+            __slots__ = ()
+            field3 = ListField(DocumentField(ITD))
+
+        self.ITD = ITD
+        self.TD = TD
+
+    def test_should_not_have_instance_dict(self):
+        td = self.TD()
+        assert not hasattr(td, '__dict__')
+        assert not isinstance(td._data, dict)
+
+    def test_attributes(self):
+        td = self.TD(field2=1)
+        assert td.field1 == 'test_string'
+        assert td.field2 == 1
+        assert td.field3 is None
+        td.field3 = [{'field2': 2}]
+        assert isinstance(td.field3[0], self.ITD)
+
+    def test_to_mongo_from_mongo(self):
+        td = self.TD(_id=ObjectId(), field2=1, field3=[self.ITD()])
+        td.validate()
+        result = td.to_mongo()
+        assert result == {
+            '_id': td.id, 'field1': 'test_string', 'field2': 1,
+            'field3': [{'field1': 'test_string'}]}
+        assert self.TD.from_mongo(result).to_mongo() == result
+
+    def test_jsonify(self):
+        td = self.TD(_id=ObjectId(), field2=1)
+        assert td.jsonify() == {
+            'id': str(td.id), 'field1': 'test_string', 'field2': 1}
+
+    def test_copy(self):
+        td = self.TD(_id=ObjectId(), field2=1, field3=[self.ITD()])
+        td_copy = td.copy()
+        assert td_copy.id is None
+        assert td_copy.field2 == 1
+        assert td_copy.field3[0] is not td.field3[0]
+
+    def test_fields_shared_with_dict_storage(self):
+        class Base(Document):
+            field1 = StringField()
+
+        class Compact(Base):
+            __slots__ = ()
+            field2 = IntField()
+
+        base = Base(field1='a')
+        compact = Compact(field1='b', field2=1)
+        assert isinstance(base._data, dict)
+        assert (base.field1, compact.field1) == ('a', 'b')
+        assert compact.to_mongo() == {'field1': 'b', 'field2': 1}
+        # dict backed documents don't access slots
+        assert Base.field1._slot is None
+        assert Compact.field1 is not Base.field1
+        assert Compact.field1._slot is not None
+        lazy = Compact.from_mongo({'field1': 'c', 'field2': 2}, lazy=True)
+        assert lazy.to_mongo() == {'field1': 'c', 'field2': 2}
+        assert lazy.field2 == 2
+
+    def test_field_added_after_class_creation(self):
+        class Other(Document):
+            field4 = StringField()
+
+        late = GenericField()
+        late.name = 'late'
+        self.TD.field4 = Other.field4
+        self.TD.late = late
+        try:
+            td = self.TD()
+            assert td.field4 is None and td.late is None
+            td.field4 = 'a'
+            td.late = 'b'
+            assert (td.field4, td.late) == ('a', 'b')
+            assert td._data['field4'] == 'a'
+        finally:
+            del self.TD.field4
+            del self.TD.late
+
+    def test_pickle(self):
+        payload = {
+            '_id': ObjectId(), 'field1': 'a', 'field2': [1, 2],
+            'field3': {'field1': 'b'}}
+        for doc_cls in (PickledDoc, CompactPickledDoc):
+            docs = [
+                doc_cls(field1='a', field2=[1]),
+                doc_cls.from_mongo(payload),
+                doc_cls.from_mongo(payload, lazy=True),
+                doc_cls.from_mongo(payload, fields=['field1']),
+            ]
+            for doc in docs:
+                for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                    result = pickle.loads(pickle.dumps(doc, protocol))
+                    assert type(result._data) is doc_cls._data_factory
+                    assert result.to_mongo() == doc.to_mongo()
+                    assert result._changed == doc._changed
+                    assert result._projection == doc._projection
+
+            loaded = pickle.loads(pickle.dumps(docs[1], 0))
+            assert loaded.to_mongo_update() == docs[1].to_mongo_update()
+            loaded.field1 = 'c'
+            assert loaded._changed == {'field1'}
+            assert docs[1]._changed == set()
+
+    def test_unpickle_documents_without_slots(self):
+        # pickled by release in which documents had instance __dict__
+        loaded = pickle.loads(
+            b'\x80\x02ctests.test_mongo\nPickledDoc\nq\x00)\x81q\x01}q\x02'
+            b'X\x05\x00\x00\x00_dataq\x03}q\x04(X\x03\x00\x00\x00_idq\x05'
+            b'cbson.objectid\nObjectId\nq\x06)\x81q\x07c_codecs\nencode\n'
+            b'q\x08X\x0f\x00\x00\x00_\x0ck\x1e*O;\x00\x01\xc2\xa1\xc2\xb2'
+            b'\xc3\x83q\tX\x06\x00\x00\x00latin1q\n\x86q\x0bRq\x0cb'
+            b'X\x06\x00\x00\x00field1q\rX\x01\x00\x00\x00aq\x0eX\x06\x00'
+            b'\x00\x00field2q\x0f]q\x10(K\x01K\x02eusb.')
+        assert loaded.id == ObjectId('5f0c6b1e2a4f3b0001a1b2c3')
+        assert loaded.to_mongo() == {
+            '_id': loaded.id, 'field1': 'a', 'field2': [1, 2]}
+        assert loaded._changed is None
+        assert loaded._projection is None
+
+        loaded = pickle.loads(
+            b'\x80\x02ctests.test_mongo\nCompactPickledDoc\nq\x00)\x81q\x01'
+            b'}q\x02X\x05\x00\x00\x00_dataq\x03}q\x04(X\x06\x00\x00\x00'
+            b'field1q\x05X\x01\x00\x00\x00bq\x06X\x06\x00\x00\x00field2'
+            b'q\x07]q\x08K\x03ausb.')
+        assert type(loaded._data) is CompactPickledDoc._data_factory
+        assert loaded.field1 == 'b'
+        assert loaded.field2 == [3]
+
+
 class TestCollection(unittest.TestCase):
     def setUp(self):
         class _TestModel(BaseDoc):
@@ -429,6 +828,121 @@ class TestCollection(unittest.TestCase):
         stored_doc = self._TestModel.objects.get(document.id)
         assert stored_doc.field1 == 'test_string2'
 
+    def test_save_should_update_changed_fields_only(self):
+        document = self._TestModel.objects.create({
+            'field1': 'test_string'
+        })
+        loaded = self._TestModel.objects.get(document.id)
+        self._get_collection().update(
+            {'_id': document.id}, {'$set': {'field3': 'external'}})
+
+        loaded.field1 = 'test_string2'
+        self._TestModel.objects.save(loaded)
+        assert loaded._changed == set()
+        stored = self._get_collection().find_one({'_id': document.id})
+        assert stored['field1'] == 'test_string2'
+        assert stored['field3'] == 'external'
+
+    def _record_updates(self):
+        collection = self._TestModel.objects.collection
+        calls = []
+        update = collection.update
+
+        def recording_update(*args, **kwargs):
+            calls.append(args)
+            return update(*args, **kwargs)
+        collection.update = recording_update
+        self.addCleanup(delattr, collection, 'update')
+        return calls
+
+    def test_save_should_skip_unchanged_mutable_fields(self):
+        class TD(BaseDoc):
+            field1 = StringField()
+            field2 = ListField(IntField())
+            field3 = DictField(GenericField())
+
+        document = TD(field1='a', field2=[1], field3={'a': {'b': 1}})
+        TD.objects.save(document)
+        loaded = TD.objects.get(document.id)
+        calls = self._record_updates()
+        TD.objects.save(loaded)
+        assert calls == []
+
+        loaded.field3['a']['b'] = 2
+        TD.objects.save(loaded)
+        assert calls[-1][1] == {'$set': {'field3': {'a': {'b': 2}}}}
+        TD.objects.save(loaded)
+        assert len(calls) == 1
+        loaded.field3['a']['b'] = 1
+        TD.objects.save(loaded)
+        assert calls[-1][1] == {'$set': {'field3': {'a': {'b': 1}}}}
+        assert TD.objects.get(document.id).field3 == {'a': {'b': 1}}
+
+    def test_loaded_documents_share_no_changes(self):
+        document = self._TestModel.objects.create({'field1': 'test_string'})
+        first = self._TestModel.objects.get(document.id)
+        second = self._TestModel.objects.get(document.id)
+        assert first._changed is second._changed
+        first.field1 = 'test_string2'
+        assert first._changed == {'field1'}
+        assert second._changed == set()
+
+    def test_save_removed_document(self):
+        document = self._TestModel.objects.create({'field1': 'test_string'})
+        loaded = self._TestModel.objects.get(document.id)
+        self._TestModel.objects.remove(loaded)
+        self._TestModel.objects.save(loaded)
+        assert self._TestModel.objects.get(document.id).field1 == \
+            'test_string'
+
+        self._get_collection().remove({'_id': document.id})
+        loaded.field1 = 'test_string2'
+        self._TestModel.objects.save(loaded)
+        assert self._TestModel.objects.get(document.id).field1 == \
+            'test_string2'
+
+        partial = self._TestModel.objects.get(document.id, fields=['field1'])
+        self._get_collection().remove({'_id': document.id})
+        partial.field1 = 'test_string3'
+        with pytest.raises(self._TestModel.DoesNotExist):
+            self._TestModel.objects.save(partial)
+
+    def test_bulk_save_removed_document(self):
+        document = self._TestModel.objects.create({'field1': 'test_string'})
+        other = self._TestModel.objects.create({'field1': 'test_string5'})
+        loaded = self._TestModel.objects.get(document.id)
+        other_loaded = self._TestModel.objects.get(other.id)
+        self._get_collection().remove({'_id': document.id})
+        loaded.field1 = 'test_string2'
+        other_loaded.field1 = 'test_string6'
+        with self._TestModel.objects.bulk() as bulk:
+            bulk.save(other_loaded)
+            bulk.save(loaded)
+        assert bulk.result.ok
+        assert bulk.result.results == [other.id, document.id]
+        assert loaded._changed == set()
+        stored = self._get_collection().find_one({'_id': document.id})
+        assert stored['field1'] == 'test_string2'
+        assert 'field2' in stored
+        self._get_collection().remove({'_id': other.id})
+
+        partial = self._TestModel.objects.get(document.id, fields=['field1'])
+        partial.field1 = 'test_string3'
+        with self._TestModel.objects.bulk() as bulk:
+            bulk.save(partial)
+        assert bulk.result.ok
+        assert bulk.result.results == [document.id]
+
+        self._get_collection().remove({'_id': document.id})
+        partial.field1 = 'test_string4'
+        with self._TestModel.objects.bulk() as bulk:
+            bulk.save(partial)
+        assert not bulk.result.ok
+        assert list(bulk.result.errors) == [0]
+        assert bulk.result.results == [None]
+        assert partial._changed == {'field1'}
+        assert self._TestModel.objects.count() == 0
+
     def test_insert(self):
         self._TestModel.objects.create({
             'field1': 'test_string'
@@ -446,6 +960,365 @@ class TestCollection(unittest.TestCase):
         ])
         assert self._TestModel.objects.count() == 4
 
+    def test_insert_with_invalid_documents(self):
+        docs = [
+            self.create_doc({'field1': 'test_string'}),
+            self.create_doc({}),
+            self.create_doc({'field1': 'test_string2'}),
+        ]
+        report = self._TestModel.objects.validate_many(docs)
+        assert list(report) == [1]
+        assert report[1][0].field_name == 'field1'
+
+        with pytest.raises(ValidationError):
+            self._TestModel.objects.insert(docs)
+        assert self._TestModel.objects.count() == 0
+
+        invalid = []
+        self._TestModel.objects.insert(docs, on_invalid=invalid.extend)
+        assert self._TestModel.objects.count() == 2
+        assert len(invalid) == 1
+        assert invalid[0][0] is docs[1]
+        assert docs[1].id is None
+
+    def test_session(self):
+        objects = self._TestModel.objects
+        document = objects.create({'field1': 'test_string'})
+        assert objects.get(document.id) is not objects.get(document.id)
+
+        with objects.session():
+            loaded = objects.get(document.id)
+            assert objects.get(str(document.id)) is loaded
+            assert objects.get({'field1': 'test_string'}) is loaded
+            assert objects.get(document.id, fields=['field1']) is loaded
+
+            with objects.session():
+                assert objects.get(document.id) is loaded
+
+            other = objects.create({'field1': 'test_string2'})
+            assert objects.get(other.id) is other
+
+            objects.update(document.id, {'$set': {'field1': 'test_string3'}})
+            reloaded = objects.get(document.id)
+            assert reloaded is not loaded
+            assert reloaded.field1 == 'test_string3'
+
+            objects.remove(document.id)
+            assert objects.get(document.id) is None
+
+        assert objects.get(other.id) is not other
+
+    def test_session_get_without_id(self):
+        objects = self._TestModel.objects
+        document = objects.create({'field1': 'test_string'})
+        with objects.session():
+            partial = objects.get(
+                document.id, fields={'_id': 0, 'field1': 1})
+            assert partial.field1 == 'test_string'
+            assert objects.get(document.id) is not partial
+
+    def test_session_is_thread_local(self):
+        objects = self._TestModel.objects
+        document = objects.create({'field1': 'test_string'})
+        result = []
+        with objects.session():
+            loaded = objects.get(document.id)
+            thread = threading.Thread(
+                target=lambda: result.append(objects.get(document.id)))
+            thread.start()
+            thread.join()
+        assert result[0] is not loaded
+
+    def test_get_cached(self):
+        objects = self._TestModel.objects
+        objects.cache = LRUCache()
+        try:
+            document = objects.create({'field1': 'test_string'})
+            loaded = objects.get(document.id)
+            cached = objects.get_or_raise(str(document.id))
+            assert cached is not loaded
+            assert cached.field1 == 'test_string'
+            assert cached._changed == set()
+            assert objects.cache.hits == 1
+            assert objects.cache.misses == 1
+
+            cached.field1 = 'test_string2'
+            assert objects.get(document.id).field1 == 'test_string'
+            objects.save(cached)
+            assert objects.get(document.id).field1 == 'test_string2'
+
+            objects.update(
+                {'field1': 'test_string2'},
+                {'$set': {'field1': 'test_string3'}})
+            assert objects.get(document.id).field1 == 'test_string3'
+
+            objects.remove(document)
+            assert objects.get(document.id) is None
+            assert objects.cache.misses == 4
+        finally:
+            objects.cache = None
+
+    def _count_finds(self):
+        collection = self._TestModel.objects.collection
+        calls = []
+        find = collection.find
+
+        def counting_find(*args, **kwargs):
+            calls.append(kwargs)
+            return find(*args, **kwargs)
+        collection.find = counting_find
+        self.addCleanup(delattr, collection, 'find')
+        return calls
+
+    def test_get_many(self):
+        objects = self._TestModel.objects
+        docs = [
+            objects.create({'field1': 'test_string{}'.format(i)})
+            for i in range(5)]
+        calls = self._count_finds()
+        missing = ObjectId()
+        ids = [docs[3].id, missing, str(docs[0].id), docs[4].id, docs[3].id]
+        result = objects.get_many(ids, chunk_size=2)
+        assert [doc and doc.field1 for doc in result] == [
+            'test_string3', None, 'test_string0', 'test_string4',
+            'test_string3']
+        assert len(calls) == 2
+
+        result = objects.get_many(
+            [docs[1].id, missing, docs[2].id],
+            fields={'_id': 0, 'field1': 1})
+        assert [doc and doc.field1 for doc in result] == [
+            'test_string1', None, 'test_string2']
+        assert result[0].id == docs[1].id and result[0].is_partial
+        result = objects.get_many([docs[1].id], fields={'_id': 0})
+        assert result[0].id == docs[1].id
+        assert result[0].field1 == 'test_string1'
+
+    def test_loader(self):
+        objects = self._TestModel.objects
+        docs = [
+            objects.create({'field1': 'test_string{}'.format(i)})
+            for i in range(3)]
+        calls = self._count_finds()
+        with objects.loader() as loader:
+            deferred = loader.load_many(doc.id for doc in docs)
+            missing = loader.load(ObjectId())
+            assert calls == []
+            assert [item.get().field1 for item in deferred] == [
+                'test_string0', 'test_string1', 'test_string2']
+            assert missing.get() is None
+            assert len(calls) == 1
+            assert loader.load(docs[0].id).get().field1 == 'test_string0'
+            assert len(calls) == 1
+
+    def test_count(self):
+        objects = self._TestModel.objects
+        objects.insert([
+            self.create_doc({'field1': 'test_string{}'.format(i % 2)})
+            for i in range(5)])
+        assert objects.count() == 5
+        assert objects.count(limit=3, max_time_ms=1000) == 3
+        assert objects.count({'field1': 'test_string0'}) == 3
+        assert objects.count(
+            {'field1': 'test_string0'}, limit=2, max_time_ms=1000) == 2
+
+    def test_count_cached(self):
+        objects = self._TestModel.objects
+        objects.count_cache = LRUCache(ttl=1)
+        try:
+            objects.create({'field1': 'test_string'})
+            assert objects.count({'field1': 'test_string'}) == 1
+            assert objects.count({'field1': 'test_string'}) == 1
+            assert objects.count_cache.hits == 1
+            objects.create({'field1': 'test_string'})
+            assert objects.count({'field1': 'test_string'}) == 2
+        finally:
+            objects.count_cache = None
+
+    def test_find_cached(self):
+        objects = self._TestModel.objects
+        objects.query_cache = LRUCache()
+        try:
+            objects.create({'field1': 'test_string'})
+            result = objects.find({'field1': 'test_string'}, cached=True)
+            assert isinstance(result, list)
+            assert len(result) == 1
+            result[0].field1 = 'changed'
+
+            result = objects.find({'field1': 'test_string'}, cached=True)
+            assert result[0].field1 == 'test_string'
+            assert objects.query_cache.hits == 1
+            assert objects.find(
+                {'field1': 'test_string'}, as_dict=True,
+                cached=True)[0]['field1'] == 'test_string'
+
+            objects.insert(self.create_doc({'field1': 'test_string'}))
+            assert len(objects.find(
+                {'field1': 'test_string'}, cached=True)) == 2
+            assert objects.query_cache.misses == 2
+        finally:
+            objects.query_cache = None
+
+    def test_insert_stream(self):
+        docs = (
+            self.create_doc({'field1': 'test_string{}'.format(i)})
+            for i in range(10))
+        progress = []
+        failed = self._TestModel.objects.insert_stream(
+            docs, chunk_size=3, progress=progress.append)
+        assert failed == []
+        assert progress == [3, 6, 9, 10]
+        assert self._TestModel.objects.count() == 10
+
+    def test_insert_stream_concurrent_with_failed_chunks(self):
+        existing = self._TestModel.objects.create({'field1': 'test_string'})
+        docs = [
+            self.create_doc({'field1': 'test_string{}'.format(i)})
+            for i in range(10)]
+        docs[4]._id = existing.id
+        invalid = []
+        docs.append(self.create_doc({}))
+        failed = self._TestModel.objects.insert_stream(
+            iter(docs), chunk_size=3, concurrency=2,
+            on_invalid=invalid.extend)
+        assert len(invalid) == 1
+        assert len(failed) == 1
+        number, failed_docs, error = failed[0]
+        assert number == 1
+        assert failed_docs == docs[3:6]
+        assert isinstance(error, PyMongoError)
+        assert docs[0]._changed == set()
+        assert self._TestModel.objects.count() == 9
+
+    def test_insert_stream_non_mongo_errors(self):
+        class _TestModel(self._TestModel):
+            field3 = GenericField()
+
+        docs = [
+            _TestModel(field1='test_string{}'.format(i)) for i in range(6)]
+        docs[2].field3 = object()
+        failed = self._TestModel.objects.insert_stream(
+            iter(docs), chunk_size=2, concurrency=2)
+        assert [number for number, _, _ in failed] == [1]
+        assert isinstance(failed[0][2], InvalidDocument)
+        assert self._TestModel.objects.count() == 4
+
+        docs = [
+            _TestModel(field1='test_string{}'.format(i)) for i in range(6)]
+        docs[4].field1 = None
+        progress = []
+        with pytest.raises(ValidationError):
+            self._TestModel.objects.insert_stream(
+                iter(docs), chunk_size=2, concurrency=2,
+                progress=progress.append)
+        assert progress == [2, 4]
+        assert all(doc.id is not None for doc in docs[:4])
+
+    def test_parallel_scan(self):
+        collection = self._get_collection()
+        start = datetime(2020, 1, 1)
+        ids = [
+            ObjectId.from_datetime(start + timedelta(minutes=i))
+            for i in range(40)]
+        collection.insert([
+            {'_id': _id, 'field1': 'test_string{}'.format(i % 4)}
+            for i, _id in enumerate(ids)])
+        objects = self._TestModel.objects
+
+        specs = objects._scan_ranges(None, 4)
+        assert len(specs) == 4
+        assert [collection.find(spec).count() for spec in specs] == \
+            [10, 10, 10, 10]
+        docs = list(objects.parallel_scan(workers=4, batch_size=3))
+        assert all(isinstance(doc, self._TestModel) for doc in docs)
+        assert sorted(doc.id for doc in docs) == ids
+
+        scan = objects.parallel_scan(
+            {'field1': 'test_string1'}, workers=3, batches=True,
+            batch_size=4, as_dict=True, fields=['field1'])
+        batches = list(scan)
+        assert all(len(batch) <= 4 for batch in batches)
+        payloads = [payload for batch in batches for payload in batch]
+        assert sorted(payload['_id'] for payload in payloads) == ids[1::4]
+        assert all(set(payload) == {'_id', 'field1'} for payload in payloads)
+
+        scan = objects.parallel_scan(workers=2, batch_size=1)
+        next(scan)
+        scan.close()
+
+        # errors of workers are raised by iteration
+        def serialize(*args, **kwargs):
+            raise ValueError('broken')
+
+        objects.serialize = serialize
+        try:
+            with pytest.raises(ValueError):
+                list(objects.parallel_scan(workers=2))
+        finally:
+            del objects.serialize
+
+    def test_parallel_scan_split_by_skip(self):
+        collection = self._get_collection()
+        collection.insert([
+            {'_id': i, 'field1': 'test_string'} for i in range(9)])
+        specs = self._TestModel.objects._scan_ranges(None, 3)
+        assert [
+            sorted(payload['_id'] for payload in collection.find(spec))
+            for spec in specs] == [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+        docs = self._TestModel.objects.parallel_scan(workers=3, as_dict=True)
+        assert sorted(payload['_id'] for payload in docs) == list(range(9))
+
+        collection.insert({'_id': 'key', 'field1': 'test_string'})
+        assert len(self._TestModel.objects._scan_ranges(None, 3)) == 1
+        assert self._TestModel.objects._scan_ranges(
+            {'field1': 'missing'}, 3) == [{'field1': 'missing'}]
+
+    def test_bulk(self):
+        existing = self._TestModel.objects.create({'field1': 'test_string'})
+        removed = self._TestModel.objects.create({'field1': 'test_string2'})
+        new = self.create_doc({'field1': 'test_string3'})
+        existing.field1 = 'test_string4'
+
+        with self._TestModel.objects.bulk() as bulk:
+            bulk.save(new)
+            bulk.save(existing)
+            bulk.update(
+                {'field1': 'test_string5'},
+                {'$set': {'field1': 'test_string5'}}, upsert=True)
+            bulk.remove(removed)
+        result = bulk.result
+        assert result.ok
+        assert new.id is not None
+        assert result.results[:2] == [new.id, existing.id]
+        assert result.details['nUpserted'] == 1
+        assert new._changed == set()
+        assert sorted(
+            doc.field1 for doc in self._TestModel.objects.find()) == [
+                'test_string3', 'test_string4', 'test_string5']
+
+    def test_bulk_errors(self):
+        existing = self._TestModel.objects.create({'field1': 'test_string'})
+        docs = [
+            self.create_doc({'field1': 'test_string2'}),
+            self.create_doc({'field1': 'test_string3', '_id': existing.id}),
+            self.create_doc({'field1': 'test_string4'}),
+        ]
+        bulk = self._TestModel.objects.bulk()
+        bulk.insert(docs)
+        result = bulk.execute()
+        assert not result.ok
+        assert sorted(result.errors) == [1]
+        assert result.skipped == {2}
+        assert result.results == [docs[0].id, None, None]
+        assert docs[2].id is None
+
+        bulk = self._TestModel.objects.bulk(ordered=False)
+        bulk.insert(docs)
+        result = bulk.execute()
+        assert sorted(result.errors) == [0, 1]
+        assert result.results == [None, None, docs[2].id]
+        assert self._TestModel.objects.count() == 3
+
     def test_find(self):
         self._TestModel.objects.create({
             'field1': 'test_string'
@@ -465,7 +1338,83 @@ class TestCollection(unittest.TestCase):
         })
         result = self._TestModel.objects.find(fields={'field2': 1})
         assert hasattr(result[0], 'field2')
-        self.assertIsNone(result[0].field1)
+        assert result[0].is_partial
+        with pytest.raises(FieldNotLoaded):
+            result[0].field1
+
+    def test_find_with_projection_excluding_id(self):
+        document = self._TestModel.objects.create({'field1': 'test_string'})
+        loaded = self._TestModel.objects.find(
+            fields={'_id': 0, 'field1': 1}).as_list()[0]
+        with pytest.raises(FieldNotLoaded):
+            loaded.id
+        assert repr(loaded) == '_TestModel:None'
+        assert loaded != document
+        with pytest.raises(TypeError):
+            hash(loaded)
+
+    def test_save_partial_document(self):
+        document = self._TestModel.objects.create({
+            'field1': 'test_string'
+        })
+        loaded = self._TestModel.objects.get(document.id, fields=['field1'])
+        assert 'field2' not in loaded._data
+        loaded.field1 = 'test_string2'
+        self._TestModel.objects.save(loaded)
+        stored = self._get_collection().find_one({'_id': document.id})
+        assert stored['field1'] == 'test_string2'
+        assert stored['field2'] == document.field2.replace(
+            microsecond=document.field2.microsecond // 1000 * 1000)
+
+        with pytest.raises(ValueError):
+            self._TestModel.objects.update(document.id, loaded)
+
+        without_id = self._TestModel.objects.get(
+            document.id, fields={'_id': 0, 'field1': 1})
+        without_id.field1 = 'test_string3'
+        with pytest.raises(ValueError):
+            self._TestModel.objects.save(without_id)
+        with pytest.raises(ValueError):
+            self._TestModel.objects.bulk().save(without_id)
+
+    def test_find_lazy(self):
+        document = self._TestModel.objects.create({
+            'field1': 'test_string'
+        })
+        result = self._TestModel.objects.find(lazy=True).as_list()
+        assert len(result) == 1
+        assert result[0].field1 == 'test_string'
+        result = self._TestModel.objects.get(document.id, lazy=True)
+        assert result.to_mongo()['_id'] == document.id
+        assert result.to_mongo()['field1'] == 'test_string'
+
+    def test_find_iter_batches(self):
+        self._TestModel.objects.insert([
+            self.create_doc({'field1': 'test_string{}'.format(i)})
+            for i in range(5)])
+        batches = list(self._TestModel.objects.find().iter_batches(2))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert all(
+            isinstance(doc, self._TestModel)
+            for batch in batches for doc in batch)
+
+    def test_find_prefetch(self):
+        self._TestModel.objects.insert([
+            self.create_doc({'field1': 'test_string{}'.format(i)})
+            for i in range(5)])
+        cursor = self._TestModel.objects.find(prefetch=2).batch_size(2)
+        result = cursor.as_list()
+        assert len(result) == 5
+        assert not cursor._prefetcher.threads[0].is_alive()
+
+        cursor = self._TestModel.objects.find(prefetch=1).batch_size(1)
+        for _ in cursor:
+            break
+        cursor.close()
+        assert not cursor._prefetcher.threads[0].is_alive()
+
+        cursor = self._TestModel.objects.find(prefetch=1)
+        assert sum(len(batch) for batch in cursor.iter_batches(2)) == 5
 
     def test_find_slice(self):
         self._TestModel.objects.create({
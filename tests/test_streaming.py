@@ -0,0 +1,94 @@
+import io
+import json
+import unittest
+from datetime import datetime
+
+from bson import ObjectId
+
+from ognom.fields import StringField, DateTimeField, ListField, IntField
+from ognom.helpers.lifecycle import DocWithLifeCycle
+from ognom.streaming import iter_json, write_json, read_ndjson
+from tests.common import BaseDoc
+
+
+class TD(BaseDoc):
+    field1 = StringField()
+    field2 = ListField(DateTimeField())
+
+
+class TestIterJson(unittest.TestCase):
+    def setUp(self):
+        self.dt = datetime(2016, 1, 2, 3, 4, 5)
+        self.docs = [
+            TD(_id=ObjectId(), field1=str(i), field2=[self.dt])
+            for i in range(10)]
+
+    def test_should_produce_json_array(self):
+        result = json.loads(''.join(iter_json(self.docs)))
+        assert result == [doc.jsonify() for doc in self.docs]
+        assert result[0]['field2'] == ['2016-01-02T03:04:05']
+
+    def test_should_split_into_chunks(self):
+        chunks = list(iter_json(self.docs, chunk_size=100))
+        assert len(chunks) > 1
+        result = json.loads(''.join(chunks))
+        assert [doc['id'] for doc in result] == [
+            str(doc.id) for doc in self.docs]
+
+    def test_empty(self):
+        assert ''.join(iter_json([])) == '[]'
+
+    def test_dicts(self):
+        _id = ObjectId()
+        result = json.loads(''.join(iter_json([{'_id': _id, 'dt': self.dt}])))
+        assert result == [{'_id': str(_id), 'dt': '2016-01-02T03:04:05'}]
+
+    def test_encoding(self):
+        chunks = list(iter_json(self.docs, encoding='utf8'))
+        assert all(isinstance(chunk, bytes) for chunk in chunks)
+
+    def test_inherited_fields(self):
+        doc = DocWithLifeCycle(created_at=self.dt)
+        assert json.loads(''.join(iter_json([doc]))) == [
+            {'created_at': '2016-01-02T03:04:05'}]
+
+    def test_write_json(self):
+        fp = io.StringIO()
+        write_json(self.docs, fp)
+        assert len(json.loads(fp.getvalue())) == 10
+
+
+class TestReadNdjson(unittest.TestCase):
+    def test_should_parse_lines(self):
+        class ITD(BaseDoc):
+            field1 = IntField()
+
+        _id = ObjectId()
+        lines = io.StringIO(
+            '{"id": "%s", "field1": 1}\n'
+            '\n'
+            '{"field1": "2"}\n' % _id)
+        docs = list(read_ndjson(ITD, lines))
+        assert [doc.field1 for doc in docs] == [1, 2]
+        assert docs[0].id == _id
+
+    def test_should_collect_errors(self):
+        class ITD(BaseDoc):
+            field1 = IntField()
+
+        lines = [
+            '{"field1": 1}', '{broken', '{"field1": "x"}', '{"id": "bad"}',
+            '{}']
+        errors = []
+        docs = list(read_ndjson(ITD, lines, errors))
+        assert [doc.field1 for doc in docs] == [1, None]
+        assert [line for line, _ in errors] == [2, 3, 4]
+        assert errors[1][1].field_name == 'field1'
+        assert errors[2][1].field_name == '_id'
+
+    def test_should_raise_without_errors_list(self):
+        class ITD(BaseDoc):
+            field1 = IntField()
+
+        with self.assertRaises(ValueError):
+            list(read_ndjson(ITD, ['{broken']))